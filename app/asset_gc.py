@@ -0,0 +1,211 @@
+# app/asset_gc.py
+# Recolector de imágenes huérfanas del almacenamiento (prefijo books/).
+# Uso: python -m app.asset_gc [--dry-run] [--grace SEGUNDOS] [--batch N]
+from sqlalchemy.orm import Session
+from typing import Dict, Iterator, List, Optional
+import argparse
+import asyncio
+import glob
+import logging
+import os
+import time
+
+from app import models
+from app.assets import LEGACY_BASE_URL, is_content_addressed
+from app.storage import StoredObject, get_storage, remove_file
+
+# Cada cuánto se ejecuta dentro del servidor (segundos); 0 = desactivado
+ASSET_GC_INTERVAL = float(os.getenv("ASSET_GC_INTERVAL", "0"))
+
+# Antigüedad mínima de un fichero para poder borrarlo: protege las subidas cuyo libro aún no ha hecho commit
+ASSET_GC_GRACE = float(os.getenv("ASSET_GC_GRACE", "3600"))
+
+# Ficheros comprobados contra la DB por consulta
+ASSET_GC_BATCH = int(os.getenv("ASSET_GC_BATCH", "500"))
+
+# Prefijos del almacenamiento con imágenes de libros
+GC_PREFIXES = ("books",)
+
+logger = logging.getLogger("uvicorn")
+
+# Resultado de la última pasada (para /metrics)
+last_report: Dict[str, object] = {}
+
+
+def _stored_forms(key: str) -> List[str]:
+    """Todos los valores de `image_url` que resuelven a `key`: la clave y los formatos antiguos (ver `assets.asset_key`)."""
+    return [key, f"uploads/{key}", f"{LEGACY_BASE_URL}/uploads/{key}"]
+
+
+def _group_id(key: str) -> str:
+    """Original y derivados comparten grupo: `books/ab/cd/<sha>`; el resto de ficheros van solos."""
+    if is_content_addressed(key):
+        directory, name = key.rsplit("/", 1)
+        return f"{directory}/{name[:64]}"
+    return key
+
+
+def iter_file_groups(prefix: str) -> Iterator[List[StoredObject]]:
+    """
+    Recorre el almacenamiento bajo `prefix` (en orden de clave, así cada grupo llega seguido)
+    y devuelve, por cada imagen, sus ficheros: el original primero (si existe) y luego sus derivados.
+    """
+    group: List[StoredObject] = []
+    for stored in get_storage().list(prefix):
+        if stored.key.endswith(".part"):
+            continue
+        if group and _group_id(group[0].key) != _group_id(stored.key):
+            yield _original_first(group)
+            group = []
+        group.append(stored)
+    if group:
+        yield _original_first(group)
+
+
+def _original_first(group: List[StoredObject]) -> List[StoredObject]:
+    group_id = _group_id(group[0].key)
+    return sorted(group, key=lambda stored: stored.key.rsplit(".", 1)[0] != group_id)
+
+
+def _batches(groups: Iterator[List[StoredObject]], size: int) -> Iterator[List[List[StoredObject]]]:
+    batch = []
+    for group in groups:
+        batch.append(group)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _referenced(db: Session, keys: List[str]) -> set:
+    """Claves de `keys` que algún libro usa como `image_url` (en cualquiera de sus formatos)."""
+    forms = {form: key for key in keys for form in _stored_forms(key)}
+    rows = db.query(models.Book.image_url).filter(models.Book.image_url.in_(list(forms))).distinct()
+    return {forms[stored] for (stored,) in rows}
+
+
+def _delete_group(db: Session, storage, group: List[StoredObject], cutoff: float) -> List[StoredObject]:
+    """
+    Borra un grupo huérfano (original y derivados) y devuelve los ficheros borrados.
+    Entre el listado y este punto una subida idéntica puede haber vuelto a usar la clave,
+    así que, como `assets.delete_unused_asset`: primero la fila, solo si sigue con refcount 0
+    (con referencias se deja todo), y después se vuelve a mirar el mtime, que `publish` renueva.
+    """
+    key = group[0].key
+    deleted = (
+        db.query(models.Asset)
+        .filter(models.Asset.key == key, models.Asset.refcount == 0)
+        .delete(synchronize_session=False)
+    )
+    db.commit()
+    if not deleted and db.query(models.Asset.key).filter(models.Asset.key == key).first() is not None:
+        return []  # refcount > 0: un libro la está usando (aunque su commit aún no se viera al listar)
+
+    current = [storage.stat(stored.key) for stored in group]
+    if any(stored is not None and stored.mtime > cutoff for stored in current):
+        return []  # se acaba de volver a subir
+    existing = [stored for stored in current if stored is not None]
+    storage.delete(stored.key for stored in existing)
+    return existing
+
+
+def collect_orphans(
+    db: Session, dry_run: bool = False, grace: Optional[float] = None, batch_size: Optional[int] = None
+) -> Dict[str, object]:
+    """
+    Compara los ficheros de GC_PREFIXES con las referencias de `books.image_url`, por lotes
+    (nunca se carga la tabla entera) y borra los que nadie usa, con sus derivados y su fila
+    de `assets`. Un derivado cuyo original ya no existe también es huérfano.
+    Con `dry_run` solo informa. Devuelve un resumen con las claves huérfanas.
+    """
+    storage = get_storage()
+    grace = ASSET_GC_GRACE if grace is None else grace
+    batch_size = batch_size or ASSET_GC_BATCH
+    cutoff = time.time() - grace
+    scanned = 0
+    orphans: List[str] = []
+    freed = 0
+
+    for prefix in GC_PREFIXES:
+        for batch in _batches(iter_file_groups(f"{prefix}/"), batch_size):
+            scanned += sum(len(group) for group in batch)
+            referenced = _referenced(db, [group[0].key for group in batch])
+            for group in batch:
+                # Recientes: puede que su libro aún no haya hecho commit
+                if group[0].key in referenced or any(stored.mtime > cutoff for stored in group):
+                    continue
+                if not dry_run:
+                    group = _delete_group(db, storage, group, cutoff)
+                    if not group:
+                        continue
+                orphans.extend(stored.key for stored in group)
+                freed += sum(stored.size for stored in group)
+
+    # Subidas interrumpidas que quedaron a medias en el directorio temporal
+    for part in glob.glob(os.path.join(storage.temp_dir(), "*.part")):
+        try:
+            stale = os.path.getmtime(part) <= cutoff
+        except FileNotFoundError:
+            continue
+        if stale and not dry_run:
+            remove_file(part)
+
+    report = {
+        "dry_run": dry_run,
+        "scanned": scanned,
+        "orphans": len(orphans),
+        "bytes": freed,
+        "keys": orphans,
+        "finished_at": time.time(),
+    }
+    logger.info(
+        f"🧹 GC de imágenes: {scanned} ficheros revisados, {len(orphans)} huérfanos, "
+        f"{freed} bytes {'a liberar (dry-run)' if dry_run else 'liberados'}"
+    )
+    last_report.clear()
+    last_report.update({name: value for name, value in report.items() if name != "keys"})
+    return report
+
+
+async def run_periodically(session_factory, interval: float) -> None:
+    """Tarea de fondo del servidor: una pasada cada `interval` segundos, fuera del event loop."""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await asyncio.to_thread(_collect_with_session, session_factory)
+        except Exception:
+            logger.exception("Fallo en el GC de imágenes")
+
+
+def _collect_with_session(session_factory) -> Dict[str, object]:
+    db = session_factory()
+    try:
+        return collect_orphans(db)
+    finally:
+        db.close()
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Borra las imágenes subidas que ningún libro referencia.")
+    parser.add_argument("--dry-run", action="store_true", help="solo listar los huérfanos, sin borrar")
+    parser.add_argument("--grace", type=float, default=ASSET_GC_GRACE, help="antigüedad mínima en segundos")
+    parser.add_argument("--batch", type=int, default=ASSET_GC_BATCH, help="ficheros por consulta")
+    args = parser.parse_args(argv)
+
+    from app.database import SessionLocal, engine, init_db
+
+    init_db(engine)
+    db = SessionLocal()
+    try:
+        report = collect_orphans(db, dry_run=args.dry_run, grace=args.grace, batch_size=args.batch)
+    finally:
+        db.close()
+    for key in report["keys"]:
+        print(key)
+    verb = "would free" if args.dry_run else "freed"
+    print(f"{report['orphans']} orphaned files, {report['bytes']} bytes {verb} ({report['scanned']} scanned)")
+
+
+if __name__ == "__main__":
+    main()
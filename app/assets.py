@@ -0,0 +1,109 @@
+# app/assets.py
+from sqlalchemy.orm import Session
+from typing import Optional
+import os
+import re
+
+from app import models
+from app.storage import get_storage
+
+# Política de caché de los ficheros direccionados por contenido: su URL nunca cambia de contenido
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+# 🌍 URL pública bajo la que se sirven los ficheros subidos (/uploads, un CDN, el bucket...)
+ASSET_BASE_URL = os.getenv("ASSET_BASE_URL", "http://localhost:8000/uploads").rstrip("/")
+
+# Host que las versiones antiguas guardaban dentro de `books.image_url`
+LEGACY_BASE_URL = os.getenv("LEGACY_BASE_URL", "http://localhost:8000").rstrip("/")
+
+
+def asset_key(stored: Optional[str]) -> Optional[str]:
+    """
+    Devuelve la clave relativa (`books/portada.jpg`) de un valor guardado en `image_url`,
+    o None si apunta a una imagen externa. Acepta los formatos antiguos
+    (`http://localhost:8000/uploads/books/...` y `uploads/books/...`).
+    """
+    if not stored:
+        return None
+    if stored.startswith(LEGACY_BASE_URL + "/"):
+        stored = stored[len(LEGACY_BASE_URL) + 1:]
+    elif stored.startswith(("http://", "https://")):
+        return None
+    if stored.startswith("uploads/"):
+        stored = stored[len("uploads/"):]
+    return stored
+
+
+def public_url(stored: Optional[str]) -> Optional[str]:
+    """URL pública de una imagen: las claves locales se resuelven contra ASSET_BASE_URL."""
+    key = asset_key(stored)
+    if key is None:
+        return stored
+    return f"{ASSET_BASE_URL}/{key}"
+
+
+def is_content_addressed(key: Optional[str]) -> bool:
+    """
+    True para claves `prefijo/ab/cd/<sha256>.<ext>` generadas por `uploads.store_upload`
+    y para sus derivados `prefijo/ab/cd/<sha256>-<ancho>w.<ext>`.
+    """
+    if not key:
+        return False
+    parts = key.split("/")
+    stem = parts[-1].split(".")[0]
+    sha256, suffix = stem[:64], stem[64:]
+    return (
+        len(parts) >= 4
+        and len(sha256) == 64
+        and parts[-3] == sha256[:2]
+        and parts[-2] == sha256[2:4]
+        and (not suffix or re.fullmatch(r"-\d+w", suffix) is not None)
+    )
+
+
+def acquire_asset(db: Session, key: str, sha256: str, size: int) -> None:
+    """Suma una referencia a `key` (crea la fila si es la primera) dentro de la transacción actual."""
+    updated = (
+        db.query(models.Asset)
+        .filter(models.Asset.key == key)
+        .update({models.Asset.refcount: models.Asset.refcount + 1}, synchronize_session=False)
+    )
+    if not updated:
+        db.add(models.Asset(key=key, sha256=sha256, size=size, refcount=1))
+
+
+def release_asset(db: Session, stored: Optional[str]) -> Optional[str]:
+    """
+    Quita una referencia a la imagen guardada en `stored` (valor de `image_url`).
+    Devuelve la clave si el fichero queda sin usar y debe borrarse tras el commit
+    (ver `delete_unused_asset`), o None.
+    """
+    key = asset_key(stored)
+    if not is_content_addressed(key):
+        # Externa, o fichero antiguo sin contador (podía compartirse por nombre): lo recoge el GC
+        return None
+    db.query(models.Asset).filter(models.Asset.key == key).update(
+        {models.Asset.refcount: models.Asset.refcount - 1}, synchronize_session=False
+    )
+    return key
+
+
+def delete_unused_asset(db: Session, key: Optional[str]) -> None:
+    """Borra el fichero (y su fila) si nadie lo referencia. Llamar después del commit."""
+    if key is None:
+        return
+    # Comprobar y borrar en una sola sentencia: una subida deduplicada concurrente puede
+    # haber vuelto a sumar la referencia desde el commit de `release_asset`
+    deleted = (
+        db.query(models.Asset)
+        .filter(models.Asset.key == key, models.Asset.refcount == 0)
+        .delete(synchronize_session=False)
+    )
+    db.commit()
+    if deleted != 1:
+        return  # otro libro lo sigue usando, o no hay fila (sin contador: lo decide el GC)
+    # El original y sus derivados (`<sha256>-<ancho>w.<ext>`)
+    storage = get_storage()
+    stem = key.rsplit(".", 1)[0]
+    derivatives = [stored.key for stored in storage.list(f"{stem}-") if is_content_addressed(stored.key)]
+    storage.delete([key, *derivatives])
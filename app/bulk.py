@@ -0,0 +1,205 @@
+# app/bulk.py
+from pydantic import ValidationError
+from sqlalchemy.orm import Session
+from typing import AsyncIterator, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+import csv
+import io
+import json
+
+from app import schemas
+from app.assets import public_url
+from app.counters import adjust_book_count
+from app.versions import bump_catalog_version
+
+# Columnas de la exportación, en orden
+EXPORT_FIELDS = ("id", "title", "author", "description", "year", "image_url", "section", "price")
+
+# Resultado por fila: {"row": n, "status": "created" | "duplicate" | "invalid", ...}
+RowResult = Dict[str, object]
+
+
+class BodyDecodeError(ValueError):
+    """Una línea del cuerpo no es UTF-8 válido."""
+
+    def __init__(self, line: int):
+        super().__init__(f"Line {line} is not valid UTF-8")
+        self.line = line
+
+
+async def iter_lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    """
+    Parte el cuerpo (en streaming) en líneas de texto UTF-8, sin cargarlo entero en memoria.
+    Se corta por bytes y se decodifica cada línea (en UTF-8 un byte `\n` nunca forma parte de
+    otro carácter): así un error de codificación se puede situar en su línea (`BodyDecodeError`).
+    """
+    pending = b""
+    number = 0
+
+    def decode(raw: bytes) -> str:
+        try:
+            return raw.decode("utf-8-sig" if number == 1 else "utf-8").rstrip("\r")
+        except UnicodeDecodeError:
+            raise BodyDecodeError(number) from None
+
+    async for chunk in chunks:
+        pending += chunk
+        *lines, pending = pending.split(b"\n")
+        for raw in lines:
+            number += 1
+            yield decode(raw)
+    if pending:
+        number += 1
+        yield decode(pending)
+
+
+async def iter_ndjson(lines: AsyncIterator[str]) -> AsyncIterator[Tuple[int, Optional[str], Optional[str]]]:
+    """
+    Devuelve `(fila, datos, error)` por cada línea no vacía. Los datos son el JSON en crudo:
+    `validate_row` lo valida directamente con Pydantic, sin pasar por `json.loads`.
+    """
+    row = 0
+    async for line in lines:
+        if not line.strip():
+            continue
+        row += 1
+        yield row, line, None
+
+
+async def iter_csv(lines: AsyncIterator[str]) -> AsyncIterator[Tuple[int, Optional[dict], Optional[str]]]:
+    """
+    Igual que `iter_ndjson` para CSV con cabecera. Un registro puede ocupar varias líneas
+    si un campo entrecomillado contiene saltos de línea: se acumula hasta cerrar las comillas.
+    """
+    header = None
+    row = 0
+    record = ""
+    async for line in lines:
+        record = f"{record}\n{line}" if record else line
+        if record.count('"') % 2:
+            continue  # comillas abiertas: el registro sigue en la siguiente línea
+        text, record = record, ""
+        if not text.strip():
+            continue
+        values = next(csv.reader([text]))
+        if header is None:
+            header = [name.strip() for name in values]
+            continue
+        row += 1
+        if len(values) != len(header):
+            yield row, None, f"Expected {len(header)} columns, got {len(values)}"
+            continue
+        # Celdas vacías = campo no informado
+        yield row, {name: value for name, value in zip(header, values) if value != ""}, None
+    if record:
+        row += 1
+        yield row, None, "Unterminated quoted field"
+
+
+# Columnas insertadas por la importación (el resto toma su valor por defecto)
+_COLUMNS = ("title", "author", "description", "year", "image_url", "section", "price")
+
+# Límite de parámetros por sentencia (SQLITE_MAX_VARIABLE_NUMBER desde SQLite 3.32)
+_MAX_PARAMS = 32766
+
+
+def _insert_sql(db: Session, rows: int) -> str:
+    """`INSERT ... VALUES (...), (...) ON CONFLICT (title) DO NOTHING RETURNING id, title` para `rows` filas."""
+    marker = "?" if db.get_bind().dialect.paramstyle == "qmark" else "%s"
+    row = "(" + ", ".join([marker] * len(_COLUMNS)) + ")"
+    return (
+        f"INSERT INTO books ({', '.join(_COLUMNS)}) VALUES {', '.join([row] * rows)} "
+        "ON CONFLICT (title) DO NOTHING RETURNING id, title"
+    )
+
+
+def insert_batch(db: Session, batch: List[Tuple[int, schemas.BookCreate]]) -> List[RowResult]:
+    """
+    Inserta un lote con sentencias multi-fila `INSERT ... ON CONFLICT (title) DO NOTHING
+    RETURNING id, title`, actualiza los contadores por sección y hace commit.
+    La SQL se envía directamente al driver: compilar parámetros fila a fila en SQLAlchemy
+    costaba más que la propia inserción.
+    """
+    results: List[RowResult] = []
+    values = []
+    rows_by_title = {}
+    for row, book in batch:
+        if book.title in rows_by_title:
+            results.append({"row": row, "status": "duplicate", "title": book.title})
+            continue
+        rows_by_title[book.title] = (row, book)
+        values.append((
+            book.title,
+            book.author,
+            book.description,
+            book.year,
+            str(book.image_url) if book.image_url else None,
+            book.section.value if book.section else None,
+            book.price or 0.0,
+        ))
+
+    created = {}
+    connection = db.connection()
+    per_statement = _MAX_PARAMS // len(_COLUMNS)
+    for start in range(0, len(values), per_statement):
+        chunk = values[start:start + per_statement]
+        params = tuple(value for row in chunk for value in row)
+        created.update(
+            (title, book_id)
+            for book_id, title in connection.exec_driver_sql(_insert_sql(db, len(chunk)), params)
+        )
+
+    added_per_section: Dict[Optional[str], int] = {}
+    for title, (row, book) in rows_by_title.items():
+        if title in created:
+            section = book.section.value if book.section else None
+            added_per_section[section] = added_per_section.get(section, 0) + 1
+            results.append({"row": row, "status": "created", "id": created[title], "section": section})
+        else:
+            results.append({"row": row, "status": "duplicate", "title": title})
+
+    for section, added in added_per_section.items():
+        adjust_book_count(db, section, added)
+    if added_per_section:
+        bump_catalog_version(db, *added_per_section)
+    db.commit()
+    return results
+
+
+def validate_row(row: int, data: Union[str, dict]) -> Tuple[Optional[schemas.BookCreate], Optional[RowResult]]:
+    """Valida una fila (dict de CSV o JSON en crudo de NDJSON) con `BookCreate`."""
+    try:
+        if isinstance(data, str):
+            return schemas.BookCreate.model_validate_json(data), None
+        return schemas.BookCreate.model_validate(data), None
+    except ValidationError as exc:
+        errors = [{"loc": list(err["loc"]), "msg": err["msg"]} for err in exc.errors()]
+        return None, {"row": row, "status": "invalid", "errors": errors}
+
+
+def iter_export(rows: Iterable, fmt: str, chunk_rows: int = 500) -> Iterator[str]:
+    """
+    Serializa filas de libros (tuplas con los campos de `EXPORT_FIELDS`) a NDJSON o CSV,
+    agrupando `chunk_rows` filas por trozo para no emitir un write por fila.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer) if fmt == "csv" else None
+    if writer:
+        writer.writerow(EXPORT_FIELDS)
+
+    pending = 0
+    for row in rows:
+        values = dict(zip(EXPORT_FIELDS, row))
+        values["image_url"] = public_url(values["image_url"])
+        if writer:
+            writer.writerow(values.values())
+        else:
+            buffer.write(json.dumps(values, ensure_ascii=False))
+            buffer.write("\n")
+        pending += 1
+        if pending >= chunk_rows:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+            pending = 0
+    if buffer.tell():
+        yield buffer.getvalue()
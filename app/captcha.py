@@ -0,0 +1,168 @@
+# app/captcha.py
+# Verificación de Cloudflare Turnstile con un cliente HTTP asíncrono compartido (keep-alive),
+# timeouts cortos y un circuit breaker: si Cloudflare falla o va lento, el login no se queda esperando.
+from typing import Optional
+import logging
+import os
+import threading
+import time
+
+import httpx
+
+from app import metrics
+
+# Cloudflare Turnstile secret de env (opcional: sin él no se verifica, modo dev)
+TURNSTILE_SECRET = os.getenv("TURNSTILE_SECRET", None)
+TURNSTILE_URL = os.getenv("TURNSTILE_URL", "https://challenges.cloudflare.com/turnstile/v0/siteverify")
+
+# Tiempo máximo de una verificación (segundos)
+TURNSTILE_TIMEOUT = float(os.getenv("TURNSTILE_TIMEOUT", "2"))
+
+# Con el servicio caído o el circuito abierto: "1" deja pasar (fail-open), "0" rechaza (fail-closed)
+TURNSTILE_FAIL_OPEN = os.getenv("TURNSTILE_FAIL_OPEN", "0") == "1"
+
+# Fallos seguidos que abren el circuito, y segundos que permanece abierto antes de reintentar
+TURNSTILE_BREAKER_THRESHOLD = int(os.getenv("TURNSTILE_BREAKER_THRESHOLD", "5"))
+TURNSTILE_BREAKER_COOLDOWN = float(os.getenv("TURNSTILE_BREAKER_COOLDOWN", "30"))
+
+logger = logging.getLogger("uvicorn")
+
+
+class CircuitBreaker:
+    """
+    closed -> (threshold fallos seguidos) -> open -> (cooldown) -> half-open:
+    se deja pasar una sola petición de prueba; si va bien se cierra, si falla se vuelve a abrir.
+    """
+
+    def __init__(self, threshold: int, cooldown: float):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        return "half-open" if time.monotonic() - self.opened_at >= self.cooldown else "open"
+
+    def allow(self) -> bool:
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return True
+            if state == "half-open" and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._probing = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            if self._probing or self.failures >= self.threshold:
+                if self.opened_at is None or self._probing:
+                    logger.warning("⚡ Turnstile: circuito abierto tras fallos consecutivos")
+                self.opened_at = time.monotonic()
+            self._probing = False
+
+
+class TurnstileVerifier:
+    """Verificador invocable: `await verifier(token, remote_ip)` -> bool."""
+
+    def __init__(
+        self,
+        secret: Optional[str] = TURNSTILE_SECRET,
+        url: str = TURNSTILE_URL,
+        timeout: float = TURNSTILE_TIMEOUT,
+        fail_open: bool = TURNSTILE_FAIL_OPEN,
+        breaker: Optional[CircuitBreaker] = None,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+    ):
+        self.secret = secret
+        self.url = url
+        self.timeout = timeout
+        self.fail_open = fail_open
+        self.breaker = breaker or CircuitBreaker(TURNSTILE_BREAKER_THRESHOLD, TURNSTILE_BREAKER_COOLDOWN)
+        self.transport = transport
+        self._client: Optional[httpx.AsyncClient] = None
+        self.counts = {"passed": 0, "rejected": 0, "errors": 0, "short_circuited": 0}
+        self.total_seconds = 0.0
+        self.requests = 0
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        # Se crea dentro del event loop que lo usa; se reutiliza entre logins (pool keep-alive)
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                timeout=httpx.Timeout(self.timeout, connect=min(self.timeout, 1.0)),
+                limits=httpx.Limits(max_connections=20, max_keepalive_connections=10),
+                transport=self.transport,
+            )
+        return self._client
+
+    async def aclose(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def __call__(self, token: str, remote_ip: Optional[str] = None) -> bool:
+        if not self.secret:
+            # No secret configured -> skip verification (dev mode)
+            return True
+        if not self.breaker.allow():
+            self.counts["short_circuited"] += 1
+            return self.fail_open
+
+        data = {"secret": self.secret, "response": token}
+        if remote_ip:
+            data["remoteip"] = remote_ip
+        started = time.perf_counter()
+        settled = False
+        try:
+            response = await self.client.post(self.url, data=data)
+            response.raise_for_status()
+            success = bool(response.json().get("success", False))
+            self.breaker.record_success()
+            settled = True
+        except (httpx.HTTPError, ValueError) as exc:
+            self.breaker.record_failure()
+            settled = True
+            self.counts["errors"] += 1
+            logger.warning(f"Turnstile no disponible ({type(exc).__name__}); fail-{'open' if self.fail_open else 'closed'}")
+            return self.fail_open
+        finally:
+            if not settled:
+                # Cancelada (cliente desconectado) o error inesperado: cuenta como fallo, y si era
+                # la petición de prueba del half-open la libera; si no, el circuito no volvería a cerrarse
+                self.breaker.record_failure()
+            self.requests += 1
+            self.total_seconds += time.perf_counter() - started
+
+        self.counts["passed" if success else "rejected"] += 1
+        return success
+
+    def stats(self) -> dict:
+        return {
+            **self.counts,
+            "requests": self.requests,
+            "avg_seconds": round(self.total_seconds / self.requests, 4) if self.requests else None,
+            "breaker": self.breaker.state,
+            "fail_open": self.fail_open,
+        }
+
+
+verifier = TurnstileVerifier()
+metrics.register("captcha", verifier.stats)
+
+
+def get_captcha_verifier() -> TurnstileVerifier:
+    """Dependencia de FastAPI: los tests la sustituyen por un verificador local."""
+    return verifier
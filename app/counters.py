@@ -0,0 +1,82 @@
+# app/counters.py
+from sqlalchemy import func, select, text, true
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.orm import Session
+from typing import Dict, Optional
+
+from app import models
+
+# Clave del contador del catálogo completo
+ALL_SECTIONS = "*"
+
+
+def _bump(db: Session, key: str, delta: int) -> None:
+    # Upsert en la misma transacción que la escritura del libro. Los contadores se siembran al
+    # arrancar (`seed_book_counts`), así que una sección sin fila es una sección sin libros.
+    stmt = insert(models.BookCounter).values(section=key, count=delta)
+    db.execute(stmt.on_conflict_do_update(
+        index_elements=[models.BookCounter.section],
+        set_={"count": models.BookCounter.count + stmt.excluded.count},
+    ))
+
+
+def adjust_book_count(db: Session, section: Optional[str], delta: int) -> None:
+    """Suma `delta` al total y al contador de `section` dentro de la transacción actual."""
+    _bump(db, ALL_SECTIONS, delta)
+    if section:
+        _bump(db, section, delta)
+
+
+def move_book_count(db: Session, old_section: Optional[str], new_section: Optional[str]) -> None:
+    """Mueve un libro de sección (el total no cambia)."""
+    if old_section == new_section:
+        return
+    if old_section:
+        _bump(db, old_section, -1)
+    if new_section:
+        _bump(db, new_section, +1)
+
+
+def get_book_count(db: Session, section: Optional[str]) -> int:
+    """Devuelve el número de libros (de una sección o total) leyendo solo su contador."""
+    counter = db.get(models.BookCounter, section or ALL_SECTIONS)
+    return counter.count if counter is not None else 0
+
+
+def seed_book_counts(bind) -> None:
+    """
+    Crea los contadores desde `books` si la DB aún no los tiene (DB anterior a los contadores).
+    Se llama al arrancar, en una transacción de escritura: ningún alta o baja puede colarse
+    entre el COUNT y el INSERT, y si varios workers arrancan a la vez solo siembra el primero.
+    """
+    with bind.connect() as conn:
+        if bind.dialect.name == "sqlite":
+            conn.exec_driver_sql("BEGIN IMMEDIATE")
+        table = models.BookCounter.__table__
+        if conn.execute(select(table.c.section).where(table.c.section == ALL_SECTIONS)).first() is None:
+            books = models.Book.__table__
+            counts = (
+                select(books.c.section, func.count(books.c.id))
+                .where(books.c.section.isnot(None))
+                .group_by(books.c.section)
+                # `WHERE true`: sin él SQLite confunde el ON CONFLICT con un JOIN ... ON
+                .union_all(select(text(f"'{ALL_SECTIONS}'"), func.count(books.c.id)).where(true()))
+            )
+            conn.execute(insert(table).from_select(["section", "count"], counts).on_conflict_do_nothing())
+        conn.commit()
+
+
+def rebuild_book_counts(db: Session) -> Dict[str, int]:
+    """Recalcula todos los contadores desde la tabla `books` (un solo GROUP BY)."""
+    counts = dict(
+        db.query(models.Book.section, func.count(models.Book.id))
+        .filter(models.Book.section.isnot(None))
+        .group_by(models.Book.section)
+        .all()
+    )
+    counts[ALL_SECTIONS] = db.query(func.count(models.Book.id)).scalar()
+
+    db.query(models.BookCounter).delete(synchronize_session=False)
+    db.add_all(models.BookCounter(section=key, count=value) for key, value in counts.items())
+    db.commit()
+    return counts
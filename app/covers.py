@@ -0,0 +1,115 @@
+# app/covers.py
+from concurrent.futures import Future, ProcessPoolExecutor
+from sqlalchemy.orm import Session
+from typing import Callable, Dict, Iterable, List, Optional, Sequence
+import logging
+import os
+import shutil
+import tempfile
+import threading
+
+from app import models
+from app.assets import IMMUTABLE_CACHE_CONTROL, asset_key, is_content_addressed, public_url
+from app.images import DERIVATIVE_FORMATS, Image, derivative_key, generate_derivatives
+from app.storage import Storage, get_storage
+from app.versions import bump_catalog_version
+
+# Anchos (px) de las versiones reducidas de cada portada
+COVER_WIDTHS = tuple(int(width) for width in os.getenv("COVER_WIDTHS", "160,320,640").split(","))
+
+# Procesos dedicados a redimensionar (fuera del proceso que atiende peticiones)
+COVER_WORKERS = int(os.getenv("COVER_WORKERS", "2"))
+
+_MIME_TYPES = {"webp": "image/webp", "jpg": "image/jpeg"}
+
+logger = logging.getLogger("uvicorn")
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=COVER_WORKERS)
+        return _pool
+
+
+def shutdown_pool() -> None:
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+
+
+def schedule_derivatives(
+    bind, key: Optional[str], on_ready: Optional[Callable[[Iterable[Optional[str]]], None]] = None
+) -> Optional[Future]:
+    """
+    Encola la generación de derivados de `key` en el pool de procesos. Llamar tras el commit.
+    Al terminar se guardan los anchos en `books.image_variants` de todos los libros con esa
+    portada y se llama a `on_ready(secciones afectadas)`.
+    """
+    if Image is None or not is_content_addressed(key):
+        return None
+    future = _get_pool().submit(generate_stored_derivatives, get_storage(), key, COVER_WIDTHS)
+    future.add_done_callback(lambda done: _record_derivatives(bind, key, done, on_ready))
+    return future
+
+
+def generate_stored_derivatives(storage: Storage, key: str, widths: Sequence[int]) -> List[int]:
+    """
+    Se ejecuta en el pool de procesos. En disco local los derivados se generan junto al original;
+    en un almacenamiento remoto se descarga el original a un directorio temporal y se suben los derivados.
+    """
+    if storage.local_root is not None:
+        return generate_derivatives(storage.local_root, key, widths)
+
+    workdir = tempfile.mkdtemp(prefix="librium-covers-")
+    try:
+        os.makedirs(os.path.join(workdir, os.path.dirname(key)), exist_ok=True)
+        storage.download(key, os.path.join(workdir, key))
+        available = generate_derivatives(workdir, key, widths)
+        for width in available:
+            for extension in DERIVATIVE_FORMATS:
+                derived = derivative_key(key, width, extension)
+                storage.publish(
+                    os.path.join(workdir, derived), derived, _MIME_TYPES[extension], IMMUTABLE_CACHE_CONTROL
+                )
+        return available
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def _record_derivatives(bind, key: str, future: Future, on_ready) -> None:
+    try:
+        widths = future.result()
+    except Exception:
+        logger.exception(f"No se pudieron generar los derivados de {key}")
+        return
+
+    with Session(bind=bind) as db:
+        books = db.query(models.Book).filter(models.Book.image_url == key)
+        sections = {section for (section,) in books.with_entities(models.Book.section).distinct()}
+        # "" = procesada, sin derivados (original más estrecho que todos los anchos)
+        books.update({models.Book.image_variants: ",".join(map(str, widths))}, synchronize_session=False)
+        bump_catalog_version(db, *sections)
+        db.commit()
+    if on_ready:
+        on_ready(sections)
+
+
+def build_srcset(stored: Optional[str], variants: Optional[str]) -> Optional[Dict[str, str]]:
+    """`{"image/webp": "<url> 160w, <url> 320w", "image/jpeg": ...}` o None si no hay derivados."""
+    key = asset_key(stored)
+    if not key or not variants:
+        return None
+    widths = variants.split(",")
+    return {
+        _MIME_TYPES[extension]: ", ".join(
+            f"{public_url(derivative_key(key, int(width), extension))} {width}w" for width in widths
+        )
+        for extension in DERIVATIVE_FORMATS
+    }
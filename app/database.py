@@ -1,8 +1,10 @@
 # app/database.py
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, inspect
+from sqlalchemy.exc import DatabaseError
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from typing import Generator
+import logging
 import os
 
 # Default local SQLite DB (dev). Puedes cambiarlo con la variable de entorno DATABASE_URL
@@ -20,6 +22,47 @@ SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 # Base declarativa
 Base = declarative_base()
 
+logger = logging.getLogger("uvicorn")
+
+
+def ensure_columns(bind) -> None:
+    """
+    Añade con ALTER TABLE las columnas nuevas de los modelos que falten en tablas existentes.
+    Solo columnas opcionales (nullable, sin default de servidor), que es lo que admite SQLite.
+    """
+    inspector = inspect(bind)
+    with bind.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing and column.nullable and column.server_default is None:
+                    column_type = column.type.compile(dialect=bind.dialect)
+                    conn.exec_driver_sql(f'ALTER TABLE {table.name} ADD COLUMN "{column.name}" {column_type}')
+
+
+def ensure_indexes(bind) -> None:
+    """
+    Crea los índices declarados en los modelos que falten en tablas ya existentes.
+    `create_all` solo crea índices al crear la tabla, así que las DBs antiguas no los tendrían.
+    """
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            try:
+                index.create(bind=bind, checkfirst=True)
+            except DatabaseError as exc:
+                # p.ej. un índice único sobre datos duplicados: la app sigue funcionando sin él
+                logger.warning(f"No se pudo crear el índice {index.name}: {exc}")
+
+
+def init_db(bind) -> None:
+    """Crea tablas (y el índice FTS), y añade columnas e índices que falten en una DB existente."""
+    Base.metadata.create_all(bind=bind)
+    ensure_columns(bind)
+    ensure_indexes(bind)
+
+
 def get_db() -> Generator:
     """Dependency que devuelve una sesión de DB y asegura que se cierre."""
     db = SessionLocal()
@@ -29,6 +72,7 @@ def get_db() -> Generator:
         db.close()
 
 # Crear todas las tablas definidas en modelos
-# ⚠ Esto NO elimina datos existentes, pero no agrega columnas nuevas automáticamente en SQLite
+# ⚠ Esto NO elimina datos existentes; las columnas nuevas las añade ensure_columns
 from app import models  # importa tus modelos para que Base conozca las tablas
-Base.metadata.create_all(bind=engine)
+from app import search  # registra el índice FTS5 de libros (se crea junto con las tablas)
+init_db(engine)
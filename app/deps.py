@@ -1,29 +1,137 @@
 # app/deps.py
 from fastapi import Cookie, Depends, HTTPException, status
 from jose import jwt, JWTError
+from sqlalchemy import event, inspect
 from sqlalchemy.orm import Session
-from typing import Optional
+from typing import NamedTuple, Optional
 import os
+import time
 
+from app.cache import TTLCache
 from app.database import get_db
-from app import models
+from app import metrics, models
+from app.revocation import denylist, is_revoked, revoke_user
 
 SECRET_KEY = os.getenv("SECRET_KEY", "supersecretkey")
 ALGORITHM = os.getenv("ALGORITHM", "HS256")
 
-def get_current_user(autorizado: Optional[str] = Cookie(None), db: Session = Depends(get_db)) -> models.User:
-    if not autorizado:
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Not authenticated")
+# 🔑 Claims ya verificados por token (nunca más allá de su `exp`)
+token_cache = TTLCache(
+    maxsize=int(os.getenv("TOKEN_CACHE_SIZE", "10000")),
+    ttl=float(os.getenv("TOKEN_CACHE_TTL", "300")),
+)
+
+# 👤 Usuarios por username: TTL corto, además se invalidan al modificarlos en este proceso
+user_cache = TTLCache(
+    maxsize=int(os.getenv("USER_CACHE_SIZE", "10000")),
+    ttl=float(os.getenv("USER_CACHE_TTL", "30")),
+)
+
+metrics.register("token_cache", token_cache.stats)
+metrics.register("user_cache", user_cache.stats)
+metrics.register("token_denylist", denylist.stats)
+
+
+class Principal(NamedTuple):
+    """Usuario autenticado según los claims del token (sin consultar la DB)."""
+    id: int
+    username: str
+    role: models.UserRole
+    jti: Optional[str] = None
+    exp: Optional[float] = None
+
+
+def decode_token(token: str) -> dict:
+    """Claims del JWT; la firma solo se verifica la primera vez que se ve cada token."""
+    claims = token_cache.get(token)
+    if claims is not None:
+        if claims.get("exp", float("inf")) <= time.time():
+            token_cache.delete(token)
+            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Could not validate credentials")
+        return claims
 
     try:
-        payload = jwt.decode(autorizado, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get("sub")
-        if username is None:
-            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token payload")
+        claims = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
     except JWTError:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Could not validate credentials")
+    ttl = token_cache.ttl
+    if "exp" in claims:
+        ttl = min(ttl, claims["exp"] - time.time())
+    token_cache.set(token, claims, ttl=ttl)
+    return claims
+
+
+def _valid_claims(autorizado: Optional[str]) -> dict:
+    """Claims de la cookie si el token es válido, tiene `sub` y no está revocado; si no, 401."""
+    if not autorizado:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Not authenticated")
+
+    claims = decode_token(autorizado)
+    if claims.get("sub") is None:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token payload")
+    if is_revoked(claims):
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Token revoked")
+    return claims
+
+
+def _claims_principal(claims: dict) -> Optional[Principal]:
+    if "uid" not in claims or "role" not in claims:
+        return None
+    return Principal(claims["uid"], claims["sub"], models.UserRole(claims["role"]), claims.get("jti"), claims.get("exp"))
+
+
+def get_token_principal(autorizado: Optional[str] = Cookie(None)) -> Principal:
+    """
+    Principal solo con los claims: no depende de `get_db`, así que nunca abre sesión.
+    Los tokens antiguos (sin `uid`/`role`) se rechazan con 401: basta con volver a iniciar sesión.
+    """
+    principal = _claims_principal(_valid_claims(autorizado))
+    if principal is None:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Token without user claims")
+    return principal
+
+
+def get_current_user(autorizado: Optional[str] = Cookie(None), db: Session = Depends(get_db)) -> Principal:
+    """
+    Principal del token: `uid`, `sub` y `role` van en los claims y se comprueba la lista de
+    revocación, todo en memoria. Los tokens antiguos (solo `sub`) resuelven el usuario con
+    `user_cache` y, si no está, con la DB.
+    """
+    claims = _valid_claims(autorizado)
+    principal = _claims_principal(claims)
+    if principal is not None:
+        return principal
+
+    username = claims["sub"]
+    cached = user_cache.get(username)
+    if cached is None:
+        user = db.query(models.User).filter(models.User.username == username).first()
+        if not user:
+            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="User not found")
+        cached = (user.id, user.username, user.role)
+        user_cache.set(username, cached)
+    return Principal(*cached, claims.get("jti"), claims.get("exp"))
+
+
+@event.listens_for(models.User, "after_update")
+def _user_updated(mapper, connection, target) -> None:
+    # Cambios hechos en este proceso; los de otros procesos caducan con USER_CACHE_TTL
+    state = inspect(target)
+    renamed = state.attrs.username.history.deleted
+    for username in {target.username, *renamed}:
+        user_cache.delete(username)
+    # Los tokens ya emitidos llevan el rol (o el nombre) anterior en sus claims
+    if renamed or state.attrs.role.history.deleted:
+        revoke_user(target.id)
+
+
+@event.listens_for(models.User, "after_delete")
+def _user_deleted(mapper, connection, target) -> None:
+    user_cache.delete(target.username)
+    revoke_user(target.id)
+
 
-    user = db.query(models.User).filter(models.User.username == username).first()
-    if not user:
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="User not found")
+def get_current_admin(user: Principal = Depends(get_current_user)) -> Principal:
+    if user.role != models.UserRole.admin:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Admin privileges required")
     return user
@@ -0,0 +1,176 @@
+# app/hashing.py
+# bcrypt en un pool de procesos propio y acotado: los picos de login/registro no ocupan
+# el threadpool de AnyIO (que comparten todas las rutas síncronas) ni el GIL del servidor.
+from concurrent.futures import ProcessPoolExecutor
+from fastapi import HTTPException
+from functools import lru_cache
+from passlib.context import CryptContext
+from typing import Optional, Tuple
+import argparse
+import asyncio
+import math
+import os
+import threading
+import time
+
+from app import metrics
+
+# Procesos dedicados a bcrypt
+HASH_WORKERS = int(os.getenv("HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+
+# Operaciones admitidas a la vez (en curso + en cola); por encima se responde 503
+HASH_QUEUE_LIMIT = int(os.getenv("HASH_QUEUE_LIMIT", str(HASH_WORKERS * 8)))
+
+# Coste de bcrypt, igual en todos los nodos: si cada nodo usara el suyo, cada login en un nodo
+# distinto rehacería el hash (un bcrypt y un commit de más). Para elegirlo: `python -m app.hashing`
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+
+# Tiempo objetivo de una verificación (ms) al calibrar (solo la herramienta de línea de comandos)
+BCRYPT_TARGET_MS = float(os.getenv("BCRYPT_TARGET_MS", "100"))
+
+# Coste mínimo aceptado aunque la máquina sea lenta
+BCRYPT_MIN_ROUNDS = int(os.getenv("BCRYPT_MIN_ROUNDS", "10"))
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+# Coste con el que se generan los hashes nuevos y hacia el que convergen los existentes
+_rounds: int = BCRYPT_ROUNDS
+
+_pool: Optional[ProcessPoolExecutor] = None
+_lock = threading.Lock()
+
+# Estado del pool (protegido por _lock)
+_pending = 0
+_stats = {"completed": 0, "rejected": 0, "total_seconds": 0.0, "max_seconds": 0.0, "last_seconds": 0.0}
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    with _lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=HASH_WORKERS)
+        return _pool
+
+
+def shutdown_pool() -> None:
+    global _pool
+    with _lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+
+
+@lru_cache(maxsize=4)
+def _context(rounds: int) -> CryptContext:
+    # min = max = default: `needs_update` marca cualquier hash con otro coste
+    return pwd_context.copy(bcrypt__default_rounds=rounds, bcrypt__min_rounds=rounds, bcrypt__max_rounds=rounds)
+
+
+# Las tareas reciben el coste como argumento: los procesos del pool no ven cambios posteriores de `_rounds`
+def _hash(password: str, rounds: int) -> str:
+    return _context(rounds).hash(password)
+
+
+def _verify_and_update(plain: str, hashed: str, rounds: int) -> Tuple[bool, Optional[str]]:
+    return _context(rounds).verify_and_update(plain, hashed)
+
+
+def calibrate_rounds(target_seconds: float, min_rounds: int = BCRYPT_MIN_ROUNDS, samples: int = 3) -> int:
+    """
+    Coste de bcrypt cuyo hash tarda lo más cerca posible de `target_seconds` en esta máquina.
+    Se mide con coste 8 (cada punto más duplica el tiempo) y se extrapola.
+    """
+    base = 8
+    elapsed = min(_timed_hash(base) for _ in range(samples))
+    rounds = base + round(math.log2(target_seconds / elapsed))
+    return max(min_rounds, min(rounds, 20))
+
+
+def _timed_hash(rounds: int) -> float:
+    started = time.perf_counter()
+    _hash("calibration", rounds)
+    return time.perf_counter() - started
+
+
+def _retry_after() -> int:
+    """Segundos estimados hasta que se vacíe la cola, según la latencia media."""
+    average = _stats["total_seconds"] / _stats["completed"] if _stats["completed"] else 0.25
+    return max(1, math.ceil(average * _pending / HASH_WORKERS))
+
+
+async def _run(fn, *args):
+    global _pending
+    with _lock:
+        if _pending >= HASH_QUEUE_LIMIT:
+            _stats["rejected"] += 1
+            retry_after = _retry_after()
+            raise HTTPException(
+                status_code=503,
+                detail="Authentication is busy, retry later",
+                headers={"Retry-After": str(retry_after)},
+            )
+        _pending += 1
+
+    started = time.perf_counter()
+    try:
+        future = _get_pool().submit(fn, *args)
+    except BaseException:
+        with _lock:
+            _pending -= 1
+        raise
+    # Se descuenta cuando el proceso termina, no cuando deja de esperar la petición:
+    # si el cliente se desconecta, el hash sigue ocupando el pool hasta acabar
+    future.add_done_callback(lambda done: _finished(started))
+    return await asyncio.wrap_future(future)
+
+
+def _finished(started: float) -> None:
+    global _pending
+    elapsed = time.perf_counter() - started
+    with _lock:
+        _pending -= 1
+        _stats["completed"] += 1
+        _stats["total_seconds"] += elapsed
+        _stats["last_seconds"] = elapsed
+        _stats["max_seconds"] = max(_stats["max_seconds"], elapsed)
+
+
+async def hash_password(password: str) -> str:
+    return await _run(_hash, password, _rounds)
+
+
+async def verify_and_update(plain: str, hashed: str) -> Tuple[bool, Optional[str]]:
+    """`(ok, nuevo_hash)`: si el hash guardado usa otro coste, se devuelve rehecho con el actual."""
+    return await _run(_verify_and_update, plain, hashed, _rounds)
+
+
+def stats() -> dict:
+    with _lock:
+        completed = _stats["completed"]
+        return {
+            "workers": HASH_WORKERS,
+            "bcrypt_rounds": _rounds,
+            "queue_limit": HASH_QUEUE_LIMIT,
+            "pending": _pending,
+            "completed": completed,
+            "rejected": _stats["rejected"],
+            "avg_seconds": round(_stats["total_seconds"] / completed, 4) if completed else None,
+            "last_seconds": round(_stats["last_seconds"], 4),
+            "max_seconds": round(_stats["max_seconds"], 4),
+        }
+
+
+metrics.register("password_hashing", stats)
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="Calibra el coste de bcrypt para esta máquina.")
+    parser.add_argument("--target-ms", type=float, default=BCRYPT_TARGET_MS, help="tiempo objetivo por hash")
+    parser.add_argument("--min-rounds", type=int, default=BCRYPT_MIN_ROUNDS)
+    args = parser.parse_args(argv)
+    rounds = calibrate_rounds(args.target_ms / 1000, args.min_rounds)
+    print(f"BCRYPT_ROUNDS={rounds}  # ~{_timed_hash(rounds) * 1000:.0f} ms por hash en esta máquina")
+
+
+if __name__ == "__main__":
+    main()
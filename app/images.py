@@ -0,0 +1,167 @@
+# app/images.py
+# Procesado de imágenes que se ejecuta en procesos hijos (ProcessPoolExecutor):
+# solo depende de la stdlib y de Pillow, nunca de la app ni de la DB.
+from typing import List, NamedTuple, Optional, Sequence
+import math
+import os
+import uuid
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow es opcional: sin él no hay derivados ni metadatos
+    Image = None
+
+# Formato de los derivados -> (extensión, opciones de guardado de Pillow)
+DERIVATIVE_FORMATS = {
+    "webp": ("WEBP", {"quality": 80, "method": 4}),
+    "jpg": ("JPEG", {"quality": 82, "optimize": True, "progressive": True}),
+}
+
+
+# Lado máximo de la miniatura de la que salen el color dominante y el placeholder
+PLACEHOLDER_SIZE = 32
+
+# Componentes del blurhash (horizontal x vertical): más en vertical para portadas
+BLURHASH_COMPONENTS = (3, 4)
+
+_BASE83 = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz#$%*+,-.:;=?@[]^_{|}~"
+
+
+class ImageInfo(NamedTuple):
+    width: int
+    height: int
+    color: str      # color dominante, "#rrggbb"
+    blurhash: str   # placeholder (https://blurha.sh), unos 30 caracteres
+
+
+def describe_image(path: str) -> Optional[ImageInfo]:
+    """
+    Dimensiones, color dominante y blurhash de una imagen, o None si no se puede decodificar.
+    Los JPEG se decodifican directamente a escala reducida (`draft`): no se lee la imagen completa.
+    """
+    if Image is None:
+        return None
+    try:
+        with Image.open(path) as image:
+            width, height = image.size
+            if image.getexif().get(0x0112, 1) in (5, 6, 7, 8):  # rotada 90º por EXIF
+                width, height = height, width
+            image.draft("RGB", (PLACEHOLDER_SIZE * 4, PLACEHOLDER_SIZE * 4))
+            small = ImageOps.exif_transpose(image)
+            small = _flatten(small.convert("RGBA"))
+            small.thumbnail((PLACEHOLDER_SIZE, PLACEHOLDER_SIZE), Image.BILINEAR)
+    except (OSError, ValueError, Image.DecompressionBombError):
+        return None
+    return ImageInfo(width, height, _dominant_color(small), blurhash(small, *BLURHASH_COMPONENTS))
+
+
+def _dominant_color(image) -> str:
+    """Color de la paleta (5 colores, median cut) que más píxeles cubre."""
+    palette_image = image.quantize(colors=5)
+    _, index = max(palette_image.getcolors())
+    red, green, blue = palette_image.getpalette()[index * 3:index * 3 + 3]
+    return f"#{red:02x}{green:02x}{blue:02x}"
+
+
+def blurhash(image, x_components: int, y_components: int) -> str:
+    """Codifica una imagen RGB (pequeña) en blurhash: DCT de baja frecuencia + base83."""
+    width, height = image.size
+    raw = image.convert("RGB").tobytes()
+    pixels = [(_LINEAR[raw[k]], _LINEAR[raw[k + 1]], _LINEAR[raw[k + 2]]) for k in range(0, len(raw), 3)]
+    cos_x = [[math.cos(math.pi * i * x / width) for x in range(width)] for i in range(x_components)]
+    cos_y = [[math.cos(math.pi * j * y / height) for y in range(height)] for j in range(y_components)]
+
+    factors = []
+    for j in range(y_components):
+        for i in range(x_components):
+            normalisation = 1 if i == j == 0 else 2
+            red = green = blue = 0.0
+            for y in range(height):
+                row = y * width
+                for x in range(width):
+                    basis = cos_x[i][x] * cos_y[j][y]
+                    pixel = pixels[row + x]
+                    red += basis * pixel[0]
+                    green += basis * pixel[1]
+                    blue += basis * pixel[2]
+            scale = normalisation / (width * height)
+            factors.append((red * scale, green * scale, blue * scale))
+
+    dc, ac = factors[0], factors[1:]
+    result = _base83((x_components - 1) + (y_components - 1) * 9, 1)
+    if ac:
+        quantised_max = max(0, min(82, math.floor(max(abs(v) for factor in ac for v in factor) * 166 - 0.5)))
+        max_value = (quantised_max + 1) / 166
+    else:
+        quantised_max, max_value = 0, 1
+    result += _base83(quantised_max, 1)
+    result += _base83((_linear_to_srgb(dc[0]) << 16) + (_linear_to_srgb(dc[1]) << 8) + _linear_to_srgb(dc[2]), 4)
+    for factor in ac:
+        r, g, b = (
+            max(0, min(18, math.floor(math.copysign(abs(v / max_value) ** 0.5, v) * 9 + 9.5))) for v in factor
+        )
+        result += _base83(r * 19 * 19 + g * 19 + b, 2)
+    return result
+
+
+def _base83(value: int, length: int) -> str:
+    return "".join(_BASE83[(value // 83 ** (length - i - 1)) % 83] for i in range(length))
+
+
+def _srgb_to_linear(value: int) -> float:
+    v = value / 255
+    return v / 12.92 if v <= 0.04045 else ((v + 0.055) / 1.055) ** 2.4
+
+
+_LINEAR = [_srgb_to_linear(value) for value in range(256)]
+
+
+def _linear_to_srgb(value: float) -> int:
+    v = max(0.0, min(1.0, value))
+    if v <= 0.0031308:
+        return int(v * 12.92 * 255 + 0.5)
+    return int((1.055 * v ** (1 / 2.4) - 0.055) * 255 + 0.5)
+
+
+def derivative_key(key: str, width: int, extension: str) -> str:
+    """`books/ab/cd/<sha>.jpg` -> `books/ab/cd/<sha>-320w.webp`"""
+    stem = key.rsplit(".", 1)[0]
+    return f"{stem}-{width}w.{extension}"
+
+
+def generate_derivatives(root: str, key: str, widths: Sequence[int]) -> List[int]:
+    """
+    Genera las versiones reducidas de `root/key` para cada ancho (sin ampliar nunca el original)
+    en todos los formatos de DERIVATIVE_FORMATS. Es idempotente: lo ya generado no se repite.
+    Devuelve los anchos disponibles.
+    """
+    if Image is None:
+        return []
+
+    with Image.open(os.path.join(root, key)) as stored:
+        # Girada según su EXIF (como la ve el navegador y como la mide `describe_image`);
+        # los derivados se guardan ya derechos y sin EXIF
+        original = ImageOps.exif_transpose(stored)
+        source_width, source_height = original.size
+        available = [width for width in sorted(widths) if width < source_width]
+        for width in available:
+            height = max(1, round(source_height * width / source_width))
+            resized = None
+            for extension, (format_name, options) in DERIVATIVE_FORMATS.items():
+                path = os.path.join(root, derivative_key(key, width, extension))
+                if os.path.exists(path):
+                    continue
+                if resized is None:
+                    resized = original.convert("RGBA").resize((width, height), Image.LANCZOS)
+                image = resized if format_name == "WEBP" else _flatten(resized)
+                tmp_path = f"{path}.{uuid.uuid4().hex}.part"
+                image.save(tmp_path, format_name, **options)
+                os.replace(tmp_path, path)
+    return available
+
+
+def _flatten(image):
+    """JPEG no admite transparencia: se compone sobre fondo blanco."""
+    background = Image.new("RGB", image.size, (255, 255, 255))
+    background.paste(image, mask=image.getchannel("A"))
+    return background
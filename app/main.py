@@ -1,24 +1,49 @@
 # app/main.py
-from fastapi import FastAPI, Request
+from fastapi import Depends, FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
+from contextlib import asynccontextmanager
+import asyncio
 import logging
 import os
 
-from app import models
-from app.database import engine
+from app import asset_gc, captcha, covers, hashing, metrics
+from app.counters import seed_book_counts
+from app.database import SessionLocal, engine, init_db
+from app.deps import Principal, get_current_admin
 from app.routes_auth import router as auth_router
 from app.routes_books import router as books_router
 from app.routes_cart import router as cart_router
+from app.static import AssetStaticFiles
+from app.storage import get_storage
+from app.uploads import UploadSizeLimitMiddleware
 
 
 
-# Crear tablas (si no existen)
-models.Base.metadata.create_all(bind=engine)
+# Crear tablas (si no existen) y migrar columnas/índices nuevos
+init_db(engine)
+# Contadores de libros por sección (solo la primera vez; después los mantienen las escrituras)
+seed_book_counts(engine)
 
-app = FastAPI(title="OnlineLibrary API")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 🧹 GC periódico de imágenes huérfanas (ASSET_GC_INTERVAL > 0)
+    gc_task = None
+    if asset_gc.ASSET_GC_INTERVAL > 0:
+        gc_task = asyncio.create_task(asset_gc.run_periodically(SessionLocal, asset_gc.ASSET_GC_INTERVAL))
+    yield
+    if gc_task is not None:
+        gc_task.cancel()
+    await captcha.verifier.aclose()
+    # Parar los procesos auxiliares al apagar el servidor
+    covers.shutdown_pool()
+    hashing.shutdown_pool()
 
-app.mount("/uploads", StaticFiles(directory="uploads"), name="uploads")
+
+app = FastAPI(title="OnlineLibrary API", lifespan=lifespan)
+
+metrics.register("asset_gc", lambda: dict(asset_gc.last_report))
+
+app.mount("/uploads", AssetStaticFiles(storage=get_storage()), name="uploads")
 
 # Configuración CORS (dev)
 origins = [
@@ -34,6 +59,9 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# 413 para subidas demasiado grandes antes de leer (y volcar a disco) el cuerpo multipart
+app.add_middleware(UploadSizeLimitMiddleware)
+
 # Logging
 logger = logging.getLogger("uvicorn")
 
@@ -46,6 +74,12 @@ async def log_requests(request: Request, call_next):
     return response
 
 
+@app.get("/metrics", tags=["ops"])
+def read_metrics(admin: Principal = Depends(get_current_admin)):
+    """Contadores internos (cachés, pools...) de este proceso"""
+    return metrics.snapshot()
+
+
 # Rutas
 app.include_router(auth_router)
 app.include_router(books_router)
@@ -0,0 +1,13 @@
+# app/metrics.py
+from typing import Any, Callable, Dict
+
+# nombre -> función que devuelve un dict con las métricas actuales del componente
+_providers: Dict[str, Callable[[], Dict[str, Any]]] = {}
+
+
+def register(name: str, provider: Callable[[], Dict[str, Any]]) -> None:
+    _providers[name] = provider
+
+
+def snapshot() -> Dict[str, Dict[str, Any]]:
+    return {name: provider() for name, provider in _providers.items()}
@@ -6,6 +6,7 @@ from sqlalchemy import (
     Text,
     Enum,
     Float,
+    Index,
 )
 from sqlalchemy.orm import relationship
 from .database import Base
@@ -41,9 +42,22 @@ class Book(Base):
     image_url = Column(String, nullable=True)
     section = Column(String, nullable=True) 
     price = Column(Float, nullable=False, default=0.0)
+    image_variants = Column(String, nullable=True)  # anchos de los derivados ya generados, p.ej. "160,320,640"
+    # Metadatos de la portada, calculados al subirla (el cliente reserva el hueco y pinta un placeholder)
+    image_width = Column(Integer, nullable=True)
+    image_height = Column(Integer, nullable=True)
+    image_color = Column(String, nullable=True)  # color dominante "#rrggbb"
+    image_blurhash = Column(String, nullable=True)
 
     cart_items = relationship("CartItem", back_populates="book")
 
+    __table_args__ = (
+        # filtro por sección + orden/keyset por id en list_books
+        Index("ix_books_section_id", "section", "id"),
+        # libros que comparten una portada (derivados, recolector de ficheros)
+        Index("ix_books_image_url", "image_url"),
+    )
+
 
 class CartItem(Base):
     __tablename__ = "cart_items"
@@ -54,3 +68,40 @@ class CartItem(Base):
 
     user = relationship("User", back_populates="cart_items")
     book = relationship("Book", back_populates="cart_items")
+
+    __table_args__ = (
+        # get_cart / clear_cart usan el prefijo user_id; add/remove el par completo
+        Index("ix_cart_items_user_book", "user_id", "book_id", unique=True),
+        # delete_book carga Book.cart_items por book_id
+        Index("ix_cart_items_book_id", "book_id"),
+    )
+
+
+class BookCounter(Base):
+    """Conteo de libros mantenido por las rutas de escritura (evita COUNT(*) al listar)."""
+    __tablename__ = "book_counters"
+
+    # section del libro, o ALL_SECTIONS para el total del catálogo
+    section = Column(String, primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
+
+
+class DataVersion(Base):
+    """
+    Versión de un conjunto de datos ("catalog", "cart:<user_id>"), base de los ETags.
+    Vive en la DB y se incrementa en la misma transacción que la escritura: todos los workers la ven.
+    """
+    __tablename__ = "data_versions"
+
+    name = Column(String, primary_key=True)
+    value = Column(Integer, nullable=False)
+
+
+class Asset(Base):
+    """Fichero subido, direccionado por contenido y compartido por todos los libros que lo usan."""
+    __tablename__ = "assets"
+
+    key = Column(String, primary_key=True)  # books/ab/cd/<sha256>.<ext>
+    sha256 = Column(String, nullable=False)
+    size = Column(Integer, nullable=False)
+    refcount = Column(Integer, nullable=False, default=0)  # libros con image_url == key
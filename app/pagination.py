@@ -0,0 +1,24 @@
+# app/pagination.py
+from fastapi import HTTPException
+from typing import Optional, Tuple
+import base64
+import json
+
+
+def encode_cursor(section: Optional[str], last_id: int) -> str:
+    """Codifica el último `(section, id)` visto en un cursor opaco (base64 url-safe)."""
+    raw = json.dumps({"s": section, "id": last_id}, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[Optional[str], int]:
+    """Decodifica un cursor generado por `encode_cursor`. Lanza 400 si no es válido."""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        data = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        section, last_id = data["s"], data["id"]
+        if (section is not None and not isinstance(section, str)) or not isinstance(last_id, int):
+            raise ValueError("bad cursor payload")
+    except (ValueError, KeyError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return section, last_id
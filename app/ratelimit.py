@@ -0,0 +1,172 @@
+# app/ratelimit.py
+# Límite de intentos de login con ventana deslizante, por usuario y por IP. Se comprueba antes
+# de tocar la DB o bcrypt: un ataque de credenciales no puede agotar la CPU del pool de hashing.
+from collections import OrderedDict, deque
+from typing import Deque, Optional, Sequence, Tuple
+import asyncio
+import math
+import os
+import sqlite3
+import threading
+import time
+
+from app import metrics
+
+# "intentos/segundos" por nombre de usuario y por IP de origen
+LOGIN_LIMIT_PER_USER = os.getenv("LOGIN_LIMIT_PER_USER", "10/60")
+LOGIN_LIMIT_PER_IP = os.getenv("LOGIN_LIMIT_PER_IP", "50/60")
+
+# "memory" (por proceso) o "sqlite" (compartido entre los workers de uvicorn de la máquina)
+LOGIN_LIMIT_BACKEND = os.getenv("LOGIN_LIMIT_BACKEND", "memory")
+LOGIN_LIMIT_DB = os.getenv("LOGIN_LIMIT_DB", "ratelimit.db")
+
+# Claves distintas recordadas en memoria (las más antiguas se olvidan primero)
+LOGIN_LIMIT_MAX_KEYS = int(os.getenv("LOGIN_LIMIT_MAX_KEYS", "100000"))
+
+# ⚠ La IP es `request.client.host`. Detrás de un proxy (nginx) es la del proxy salvo que uvicorn
+# confíe en su X-Forwarded-For: arrancar con `--forwarded-allow-ips <IP del proxy>` (o la variable
+# FORWARDED_ALLOW_IPS, que uvicorn lee); si no, todos los usuarios comparten un único límite por IP.
+
+# Una comprobación: (clave, intentos, segundos)
+Check = Tuple[str, int, float]
+
+
+def parse_limit(value: str) -> Tuple[int, float]:
+    """`"10/60"` -> `(10, 60.0)`"""
+    attempts, _, seconds = value.partition("/")
+    return int(attempts), float(seconds)
+
+
+class SlidingWindow:
+    """Marcas de tiempo de los intentos de cada clave, en memoria del proceso."""
+
+    def __init__(self, max_keys: int = LOGIN_LIMIT_MAX_KEYS):
+        self.max_keys = max_keys
+        self._hits: "OrderedDict[str, Deque[float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def hit(self, key: str, limit: int, window: float) -> Optional[float]:
+        """Registra un intento. Si la clave ya agotó su límite, no lo registra y devuelve los segundos de espera."""
+        exhausted = self.hit_all([(key, limit, window)])
+        return exhausted[1] if exhausted else None
+
+    def hit_all(self, checks: Sequence[Check]) -> Optional[Tuple[int, float]]:
+        """
+        Comprueba todas las ventanas y, solo si ninguna está agotada, registra el intento en todas.
+        Devuelve None, o `(índice de la primera agotada, segundos de espera)`.
+        """
+        now = time.time()
+        with self._lock:
+            windows = []
+            for index, (key, limit, window) in enumerate(checks):
+                hits = self._hits.get(key)
+                if hits is None:
+                    hits = self._hits[key] = deque()
+                    while len(self._hits) > self.max_keys:
+                        self._hits.popitem(last=False)
+                self._hits.move_to_end(key)
+                while hits and hits[0] <= now - window:
+                    hits.popleft()
+                if len(hits) >= limit:
+                    return index, hits[0] + window - now
+                windows.append(hits)
+            for hits in windows:
+                hits.append(now)
+            return None
+
+    def clear(self) -> None:
+        with self._lock:
+            self._hits.clear()
+
+
+class SqliteSlidingWindow:
+    """La misma ventana sobre un fichero SQLite (WAL) que comparten todos los procesos."""
+
+    def __init__(self, path: str = LOGIN_LIMIT_DB):
+        self.path = path
+        self._local = threading.local()
+        self._purged_at = 0.0
+        with self._connection() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS login_attempts (key TEXT NOT NULL, ts REAL NOT NULL)")
+            conn.execute("CREATE INDEX IF NOT EXISTS ix_login_attempts_key_ts ON login_attempts (key, ts)")
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def hit(self, key: str, limit: int, window: float) -> Optional[float]:
+        exhausted = self.hit_all([(key, limit, window)])
+        return exhausted[1] if exhausted else None
+
+    def hit_all(self, checks: Sequence[Check]) -> Optional[Tuple[int, float]]:
+        now = time.time()
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")  # serializa el contar-e-insertar entre procesos
+        try:
+            for index, (key, limit, window) in enumerate(checks):
+                conn.execute("DELETE FROM login_attempts WHERE key = ? AND ts <= ?", (key, now - window))
+                count, oldest = conn.execute(
+                    "SELECT count(*), min(ts) FROM login_attempts WHERE key = ?", (key,)
+                ).fetchone()
+                if count >= limit:
+                    conn.execute("COMMIT")
+                    return index, oldest + window - now
+            conn.executemany(
+                "INSERT INTO login_attempts (key, ts) VALUES (?, ?)", [(key, now) for key, _, _ in checks]
+            )
+            longest = max((window for _, _, window in checks), default=0)
+            if now - self._purged_at > longest:
+                # Claves que nadie ha vuelto a usar
+                conn.execute("DELETE FROM login_attempts WHERE ts <= ?", (now - longest,))
+                self._purged_at = now
+            conn.execute("COMMIT")
+            return None
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def clear(self) -> None:
+        self._connection().execute("DELETE FROM login_attempts")
+
+
+class LoginLimiter:
+    def __init__(self, backend, per_user: str = LOGIN_LIMIT_PER_USER, per_ip: str = LOGIN_LIMIT_PER_IP):
+        self.backend = backend
+        self.per_user = parse_limit(per_user)
+        self.per_ip = parse_limit(per_ip)
+        self.limited = {"user": 0, "ip": 0}
+
+    def check(self, username: str, ip: Optional[str]) -> Optional[int]:
+        """
+        Registra el intento; devuelve None si se permite o los segundos para `Retry-After`.
+        Se comprueban ambas ventanas antes de registrar en ninguna: un intento rechazado por
+        el límite del usuario no gasta el cupo de su IP (ni al revés).
+        """
+        kinds = ["user"]
+        checks = [(f"user:{username.lower()}", *self.per_user)]
+        if ip:
+            kinds.insert(0, "ip")
+            checks.insert(0, (f"ip:{ip}", *self.per_ip))
+        exhausted = self.backend.hit_all(checks)
+        if exhausted is None:
+            return None
+        index, wait = exhausted
+        self.limited[kinds[index]] += 1
+        return max(1, math.ceil(wait))
+
+    async def check_async(self, username: str, ip: Optional[str]) -> Optional[int]:
+        if isinstance(self.backend, SlidingWindow):
+            return self.check(username, ip)  # microsegundos: no merece un hilo
+        return await asyncio.to_thread(self.check, username, ip)
+
+    def stats(self) -> dict:
+        return {"backend": type(self.backend).__name__, **{f"limited_{kind}": n for kind, n in self.limited.items()}}
+
+
+login_limiter = LoginLimiter(SqliteSlidingWindow() if LOGIN_LIMIT_BACKEND == "sqlite" else SlidingWindow())
+metrics.register("login_limiter", login_limiter.stats)
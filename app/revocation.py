@@ -0,0 +1,66 @@
+# app/revocation.py
+# Lista de revocación en memoria de los tokens de acceso. Las entradas caducan solas cuando ya no
+# pueden afectar a ningún token válido: las de un `jti` con su `exp`, las de un usuario al cabo de
+# ACCESS_TOKEN_EXPIRE_MINUTES. Es por proceso: con varios workers cada uno tiene la suya.
+from typing import Any, Dict, Hashable, List, Optional, Tuple
+import heapq
+import os
+import threading
+import time
+
+ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "30"))
+
+
+class Denylist:
+    """
+    Diccionario con caducidad por entrada. A diferencia de `TTLCache` no expulsa por tamaño
+    (perder una revocación reabriría el token): solo se purga lo caducado.
+    """
+
+    def __init__(self):
+        self._entries: Dict[Hashable, Tuple[float, Any]] = {}
+        self._expiry: List[Tuple[float, Hashable]] = []  # montículo (caduca, clave)
+        self._lock = threading.Lock()
+
+    def add(self, key: Hashable, value: Any, expires_at: float) -> None:
+        with self._lock:
+            self._purge(time.time())
+            self._entries[key] = (expires_at, value)
+            heapq.heappush(self._expiry, (expires_at, key))
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None or entry[0] <= time.time():
+            return None
+        return entry[1]
+
+    def _purge(self, now: float) -> None:
+        while self._expiry and self._expiry[0][0] <= now:
+            expires_at, key = heapq.heappop(self._expiry)
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == expires_at:
+                del self._entries[key]
+
+    def stats(self) -> Dict[str, int]:
+        return {"size": len(self._entries)}
+
+
+denylist = Denylist()
+
+
+def revoke_token(jti: str, exp: float) -> None:
+    """Revoca un token concreto (logout) hasta su expiración."""
+    denylist.add(("jti", jti), True, exp)
+
+
+def revoke_user(user_id: int) -> None:
+    """Revoca todos los tokens emitidos hasta ahora para el usuario (cambio de rol, reset de contraseña)."""
+    now = time.time()
+    denylist.add(("uid", user_id), now, now + ACCESS_TOKEN_EXPIRE_MINUTES * 60)
+
+
+def is_revoked(claims: dict) -> bool:
+    if denylist.get(("jti", claims.get("jti"))):
+        return True
+    cutoff = denylist.get(("uid", claims.get("uid")))
+    return cutoff is not None and claims.get("iat", 0) <= cutoff
@@ -1,16 +1,22 @@
 # app/routes_auth.py
-from fastapi import APIRouter, Depends, HTTPException, Response
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
+from fastapi.concurrency import run_in_threadpool
 from fastapi.responses import JSONResponse
 from sqlalchemy.orm import Session
-from passlib.context import CryptContext
 from jose import jwt
 from datetime import datetime, timedelta
-from typing import Dict
+from typing import Dict, Union
 import os
-import requests
+import time
+import uuid
 
 from app import models, schemas
+from app.captcha import TurnstileVerifier, get_captcha_verifier
 from app.database import get_db
+from app.deps import Principal, get_current_user, get_token_principal
+from app.revocation import revoke_token
+from app.hashing import hash_password, verify_and_update
+from app.ratelimit import login_limiter
 
 router = APIRouter(prefix="/auth", tags=["auth"])
 
@@ -19,84 +25,96 @@ SECRET_KEY = os.getenv("SECRET_KEY", "supersecretkey")
 ALGORITHM = os.getenv("ALGORITHM", "HS256")
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "30"))
 
-# Cloudflare Turnstile secret de env (opcional)
-TURNSTILE_SECRET = os.getenv("TURNSTILE_SECRET", None)
+# Segundos que el navegador puede reutilizar la respuesta de /auth/me
+ME_CACHE_MAX_AGE = int(os.getenv("ME_CACHE_MAX_AGE", "15"))
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
-
-def get_password_hash(password: str) -> str:
-    return pwd_context.hash(password)
+def create_access_token(data: Dict[str, Union[str, int]], expires_delta: timedelta = None) -> str:
+    """
+    JWT con `exp`, `iat` (con decimales, para comparar con las revocaciones por usuario)
+    y un `jti` único (para revocar este token en concreto).
+    """
+    to_encode = data.copy()
+    expire = datetime.utcnow() + (expires_delta or timedelta(minutes=15))
+    to_encode.update({"exp": expire, "iat": time.time(), "jti": uuid.uuid4().hex})
+    return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
 
-def verify_password(plain: str, hashed: str) -> bool:
-    return pwd_context.verify(plain, hashed)
+# Las rutas de auth son async (esperan al pool de bcrypt): la I/O de la DB va al threadpool
+# con estas funciones para no bloquear el event loop.
+def _find_user(db: Session, username: str):
+    return db.query(models.User).filter(models.User.username == username).first()
 
 
-def create_access_token(data: Dict[str, str], expires_delta: timedelta = None) -> str:
-    to_encode = data.copy()
-    expire = datetime.utcnow() + (expires_delta or timedelta(minutes=15))
-    to_encode.update({"exp": expire})
-    return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+def _add_user(db: Session, new_user: models.User) -> models.User:
+    db.add(new_user)
+    db.commit()
+    db.refresh(new_user)
+    return new_user
 
 
-def verify_captcha(token: str) -> bool:
-    """
-    Verifies Cloudflare Turnstile token.
-    Returns True if successful, False otherwise.
-    If TURNSTILE_SECRET is not set, returns True (so you can disable captcha in dev).
-    """
-    if not TURNSTILE_SECRET:
-        # No secret configured -> skip verification (dev mode)
-        return True
-
-    try:
-        resp = requests.post(
-            "https://challenges.cloudflare.com/turnstile/v0/siteverify",
-            data={"secret": TURNSTILE_SECRET, "response": token},
-            timeout=5,
-        )
-        result = resp.json()
-        return result.get("success", False)
-    except requests.RequestException:
-        return False
+def _save_hash(db: Session, db_user: models.User, new_hash: str) -> None:
+    db_user.hashed_password = new_hash
+    db.commit()
 
 
 @router.post("/register", response_model=schemas.UserResponse)
-def register(user: schemas.UserCreate, db: Session = Depends(get_db)):
-    existing = db.query(models.User).filter(models.User.username == user.username).first()
+async def register(user: schemas.UserCreate, db: Session = Depends(get_db)):
+    existing = await run_in_threadpool(_find_user, db, user.username)
     if existing:
         raise HTTPException(status_code=400, detail="Usuario ya existe")
 
-    hashed_pw = get_password_hash(user.password)
+    # bcrypt en su propio pool de procesos (503 + Retry-After si está saturado)
+    hashed_pw = await hash_password(user.password)
     new_user = models.User(username=user.username, hashed_password=hashed_pw, role=user.role)
-    db.add(new_user)
-    db.commit()
-    db.refresh(new_user)
-    return new_user
+    return await run_in_threadpool(_add_user, db, new_user)
 
 
 @router.post("/login")
-def login(user: schemas.UserLogin, response: Response, db: Session = Depends(get_db)):
+async def login(
+    user: schemas.UserLogin,
+    request: Request,
+    response: Response,
+    db: Session = Depends(get_db),
+    verify_captcha: TurnstileVerifier = Depends(get_captcha_verifier),
+):
     """
     Login endpoint:
-    - Validates captchaToken (if configured)
-    - Validates username/password
+    - Throttles attempts per username and per client IP (429 + Retry-After) before any DB/bcrypt work
+    - Validates captchaToken (if configured; async, pooled, behind a circuit breaker)
+    - Validates username/password (bcrypt runs in the hashing process pool; 503 if saturated)
     - Returns 401/403 JSONResponse on error
     - On success sets an httpOnly cookie with the JWT
     """
+    # 0) rate limit (ventana deslizante)
+    remote_ip = request.client.host if request.client else None
+    retry_after = await login_limiter.check_async(user.username, remote_ip)
+    if retry_after is not None:
+        return JSONResponse(
+            status_code=429,
+            content={"status": 429, "message": "Demasiados intentos, inténtalo más tarde"},
+            headers={"Retry-After": str(retry_after)},
+        )
+
     # 1) captcha (optional)
-    if user.captchaToken is not None and not verify_captcha(user.captchaToken):
+    if user.captchaToken is not None and not await verify_captcha(user.captchaToken, remote_ip):
         return JSONResponse(status_code=403, content={"status": 403, "message": "Captcha inválido"})
 
     # 2) user lookup
-    db_user = db.query(models.User).filter(models.User.username == user.username).first()
-    if not db_user or not verify_password(user.password, db_user.hashed_password):
+    db_user = await run_in_threadpool(_find_user, db, user.username)
+    if not db_user:
         return JSONResponse(status_code=401, content={"status": 401, "message": "Credenciales inválidas"})
+    valid, new_hash = await verify_and_update(user.password, db_user.hashed_password)
+    if not valid:
+        return JSONResponse(status_code=401, content={"status": 401, "message": "Credenciales inválidas"})
+    if new_hash:
+        # Hash con otro coste de bcrypt: se guarda rehecho con el coste calibrado
+        await run_in_threadpool(_save_hash, db, db_user, new_hash)
 
     # 3) create token
     access_token = create_access_token(
-        data={"sub": db_user.username},
+        # uid y role en el token: las rutas autorizan sin consultar la DB
+        data={"sub": db_user.username, "uid": db_user.id, "role": db_user.role.value},
         expires_delta=timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES),
     )
 
@@ -113,11 +131,27 @@ def login(user: schemas.UserLogin, response: Response, db: Session = Depends(get
     return {"status": 200, "message": "Login successful", "username": db_user.username, "role": db_user.role.value}
 
 
+@router.post("/logout")
+def logout(response: Response, principal: Principal = Depends(get_current_user)):
+    """Revoca el token actual (hasta su expiración) y borra la cookie."""
+    if principal.jti and principal.exp:
+        revoke_token(principal.jti, principal.exp)
+    response.delete_cookie("autorizado")
+    return {"status": 200, "message": "Logout successful"}
+
+
 @router.get("/me")
-def me(response: Response, db: Session = Depends(get_db)):
+def me(response: Response, principal: Principal = Depends(get_token_principal)):
     """
-    Simple 'me' endpoint: for demo purposes it only reports that the server is alive.
-    In a real app, you would decode the JWT from the 'autorizado' cookie and fetch user info.
+    Current user, answered from the 'autorizado' cookie claims (no DB session is opened).
+    Cached privately by the browser for a few seconds; `Vary: Cookie` so login/logout miss the cache.
     """
-    # NOTE: For real apps: validate the cookie JWT and fetch the user.
-    return {"status": 200, "message": "ok"}
+    response.headers["Cache-Control"] = f"private, max-age={ME_CACHE_MAX_AGE}"
+    response.headers["Vary"] = "Cookie"
+    return {
+        "status": 200,
+        "id": principal.id,
+        "username": principal.username,
+        "role": principal.role.value,
+        "expires_at": principal.exp,
+    }
@@ -1,23 +1,71 @@
 from fastapi import (
-    APIRouter, Depends, HTTPException, UploadFile, Form, Query
+    APIRouter, Depends, HTTPException, UploadFile, Form, Query, Request, Response
 )
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
 from typing import List, Optional
+import json
 import os
-import shutil
 import math
 
-from app import schemas, models
+from app import metrics, schemas, models
+from app.assets import acquire_asset, delete_unused_asset, release_asset
+from app.bulk import EXPORT_FIELDS, BodyDecodeError, insert_batch, iter_csv, iter_export, iter_lines, iter_ndjson, validate_row
+from app.cache import TTLCache
+from app.counters import ALL_SECTIONS, adjust_book_count, get_book_count, move_book_count, rebuild_book_counts
+from app.covers import schedule_derivatives
 from app.database import get_db
+from app.deps import Principal, get_current_admin
+from app.pagination import decode_cursor, encode_cursor
+from app.search import build_match_query, search_available, search_books
+from app.uploads import cover_columns, store_upload
+from app.versions import bump_catalog_version, catalog_version, etag_headers, make_etag, not_modified
 
 router = APIRouter(prefix="/books", tags=["books"])
 
-# 📂 Directorio de subida de imágenes
-UPLOAD_DIR = "uploads/books"
-os.makedirs(UPLOAD_DIR, exist_ok=True)
+# 📦 Tamaño de lote por defecto de la importación masiva
+BULK_BATCH_SIZE = int(os.getenv("BULK_IMPORT_BATCH_SIZE", "1000"))
 
-# 🌍 URL base de tu servidor (ajústala según tu entorno)
-BASE_URL = "http://localhost:8000"
+# Filas que el driver entrega por vuelta al exportar
+EXPORT_YIELD_PER = int(os.getenv("EXPORT_YIELD_PER", "1000"))
+
+# 🗄 Caché de páginas del catálogo: clave (section, page, limit, cursor) -> (body JSON, headers)
+catalog_cache = TTLCache(
+    maxsize=int(os.getenv("CATALOG_CACHE_SIZE", "1024")),
+    ttl=float(os.getenv("CATALOG_CACHE_TTL", "60")),
+)
+metrics.register("catalog_cache", catalog_cache.stats)
+
+
+# Columnas que admite `fields=` (image_srcset y los metadatos de la portada acompañan a image_url)
+BOOK_FIELDS = ("id", "title", "author", "description", "year", "image_url", "section", "price")
+IMAGE_FIELDS = ("image_width", "image_height", "image_color", "image_blurhash")
+
+
+def parse_fields(fields: Optional[str]) -> Optional[tuple]:
+    """`"title,id"` -> `("id", "title")` en orden canónico; None = libro completo."""
+    if not fields:
+        return None
+    requested = {name.strip() for name in fields.split(",") if name.strip()}
+    unknown = requested - set(BOOK_FIELDS)
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(sorted(unknown))}")
+    requested.add("id")  # necesario para el cursor
+    if "image_url" in requested:
+        requested.update(("image_variants", *IMAGE_FIELDS))  # image_variants: para image_srcset
+    return tuple(name for name in (*BOOK_FIELDS, "image_variants", *IMAGE_FIELDS) if name in requested)
+
+
+def catalog_changed(*sections: Optional[str]) -> None:
+    """
+    Invalida las páginas cacheadas en este proceso afectadas por un cambio ya confirmado (commit):
+    las de cada sección tocada y las del listado sin filtro. La versión del catálogo ya se
+    incrementó en la transacción del cambio (`bump_catalog_version`); los demás workers dejan
+    de usar sus páginas porque la versión forma parte de la clave.
+    """
+    affected = {None, *sections}
+    catalog_cache.invalidate(lambda key: key[0] in affected)
 
 
 # -------------------------------
@@ -40,13 +88,10 @@ async def create_book(
     if db.query(models.Book).filter(models.Book.title == title).first():
         raise HTTPException(status_code=400, detail="Book already exists")
 
-    # 🖼 Guardar imagen si se sube
-    saved_image_url = None
+    # 🖼 Guardar imagen si se sube (direccionada por contenido)
+    stored = None
     if image and image.filename:
-        file_path = os.path.join(UPLOAD_DIR, image.filename)
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(image.file, buffer)
-        saved_image_url = f"{BASE_URL}/{file_path}"
+        stored = await store_upload(image)
 
     # 🧱 Crear libro
     new_book = models.Book(
@@ -56,52 +101,253 @@ async def create_book(
         year=year,
         section=section.value if section else None,
         price=price,
-        image_url=saved_image_url,
+        **(cover_columns(stored) if stored else {}),
     )
 
     db.add(new_book)
+    if stored:
+        acquire_asset(db, stored.key, stored.sha256, stored.size)
+    adjust_book_count(db, new_book.section, +1)
+    bump_catalog_version(db, new_book.section)
     db.commit()
+    catalog_changed(new_book.section)
+    if stored:
+        schedule_derivatives(db.get_bind(), stored.key, on_ready=lambda sections: catalog_changed(*sections))
     db.refresh(new_book)
     return new_book
 
 
+# -------------------------------
+# 📦 Importación masiva (NDJSON / CSV)
+# -------------------------------
+@router.post("/bulk")
+async def bulk_import_books(
+    request: Request,
+    format: Optional[str] = Query(None, pattern="^(ndjson|csv)$"),
+    batch_size: int = Query(BULK_BATCH_SIZE, ge=1, le=10000),
+    db: Session = Depends(get_db),
+):
+    """
+    Importar libros desde el cuerpo de la petición, leído en streaming.
+    Formato `ndjson` (un objeto por línea) o `csv` con cabecera; por defecto se deduce
+    del `Content-Type`. Cada fila se valida con `BookCreate` y se inserta por lotes;
+    los títulos ya existentes se informan como `duplicate`.
+    """
+    if format is None:
+        format = "csv" if "csv" in request.headers.get("content-type", "") else "ndjson"
+    parse = iter_csv if format == "csv" else iter_ndjson
+
+    results = []
+    batch = []
+    sections = set()
+
+    async def flush():
+        # La escritura es síncrona: al threadpool para no bloquear el event loop
+        inserted = await run_in_threadpool(insert_batch, db, batch)
+        sections.update(r["section"] for r in inserted if r["status"] == "created")
+        results.extend(inserted)
+        batch.clear()
+
+    decode_error = None
+    try:
+        async for row, data, error in parse(iter_lines(request.stream())):
+            if error:
+                results.append({"row": row, "status": "invalid", "errors": [{"loc": [], "msg": error}]})
+                continue
+            book, invalid = validate_row(row, data)
+            if invalid:
+                results.append(invalid)
+                continue
+            batch.append((row, book))
+            if len(batch) >= batch_size:
+                await flush()
+    except BodyDecodeError as exc:
+        # El resto del cuerpo no se puede leer: se para aquí (el lote pendiente no se inserta)
+        decode_error = exc
+    if batch and decode_error is None:
+        await flush()
+
+    if sections:
+        catalog_changed(*sections)
+    results.sort(key=lambda r: r["row"])
+    summary = {status: sum(r["status"] == status for r in results) for status in ("created", "duplicate", "invalid")}
+    content = {**summary, "results": results}
+    if decode_error is not None:
+        # 400 con la línea; `results` informa de los lotes que ya se habían confirmado
+        content = {"detail": str(decode_error), "line": decode_error.line, **content}
+    # Resultado de tipos JSON nativos: se evita jsonable_encoder (muy lento con decenas de miles de filas)
+    return Response(
+        content=json.dumps(content),
+        status_code=400 if decode_error is not None else 200,
+        media_type="application/json",
+    )
+
+
+# -------------------------------
+# 📤 Exportar catálogo (NDJSON / CSV)
+# -------------------------------
+@router.get("/export")
+def export_books(
+    format: str = Query("ndjson", pattern="^(ndjson|csv)$"),
+    section: Optional[schemas.SectionEnum] = Query(None),
+    db: Session = Depends(get_db),
+):
+    """
+    Volcado completo del catálogo (o de una sección) en una sola pasada por la tabla.
+    Las filas se leen con `yield_per` y se envían según llegan: la memoria no crece con el catálogo.
+    """
+    query = db.query(*(getattr(models.Book, name) for name in EXPORT_FIELDS))
+    if section:
+        query = query.filter(models.Book.section == section.value)
+    rows = query.order_by(models.Book.id).yield_per(EXPORT_YIELD_PER)
+
+    def stream():
+        try:
+            yield from iter_export(rows, format)
+        finally:
+            db.close()
+
+    media_type = "text/csv" if format == "csv" else "application/x-ndjson"
+    filename = f"books{'-' + section.value if section else ''}.{format}"
+    return StreamingResponse(
+        stream(),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+
 # -------------------------------
 # 🟡 Listar libros (con filtros y paginación)
 # -------------------------------
 @router.get("/", response_model=schemas.PaginatedBooks)
 def list_books(
+    request: Request,
     section: Optional[schemas.SectionEnum] = Query(None),
     page: int = Query(1, ge=1),
-    limit: int = Query(12, le=100),
+    limit: int = Query(12, ge=1, le=100),
+    cursor: Optional[str] = Query(None),
+    fields: Optional[str] = Query(None, description="Campos a devolver, p.ej. `id,title,author,price,image_url`"),
     db: Session = Depends(get_db),
 ):
     """
     Listar todos los libros.
     Se puede filtrar por `section`, y paginar con `page` y `limit`.
+    Para catálogos grandes usar `cursor` (keyset): cada respuesta trae `next_cursor`
+    y una cabecera `Link: rel="next"`; en ese modo `page` se ignora.
+    Las páginas se sirven desde `catalog_cache` mientras no cambie el catálogo, y con
+    `If-None-Match` y la versión sin cambios se responde 304. La versión sale de la copia
+    en memoria de `app.versions` (sin abrir conexión) y solo se lee de la DB cuando caduca
+    (VERSION_CACHE_TTL): los cambios hechos en otro worker se ven con ese retraso como máximo.
+    Con `fields` solo se leen (y devuelven) esas columnas; `id` siempre se incluye.
     """
-    query = db.query(models.Book)
+    section_value = section.value if section else None
+    # La versión se lee antes de consultar: si cambia a mitad, el ETag queda "viejo" (nunca al revés)
+    version = catalog_version(db, section_value)
+    etag = make_etag("books", version, request.url.query)
+    unchanged = not_modified(request, etag)
+    if unchanged is not None:
+        return unchanged
+
+    selected = parse_fields(fields)
+    cache_key = (section_value, None if cursor else page, limit, cursor, selected, version)
+    # Acierto con la versión aún en memoria: la sesión no llega a pedir conexión. Si la copia de
+    # la versión ha caducado, basta una lectura por clave primaria (`data_versions`) antes de esto
+    cached = catalog_cache.get(cache_key)
+    if cached is not None:
+        body, headers = cached
+        return Response(content=body, media_type="application/json", headers={**headers, **etag_headers(etag)})
+
+    # 🪶 Sparse fieldset: SELECT solo de las columnas pedidas (filas ligeras, sin instancias ORM)
+    if selected:
+        query = db.query(*(getattr(models.Book, name) for name in selected))
+    else:
+        query = db.query(models.Book)
 
     if section:
-        query = query.filter(models.Book.section == section.value)
+        query = query.filter(models.Book.section == section_value)
 
-    total = query.count()
-    books = (
-        query.offset((page - 1) * limit)
-        .limit(limit)
-        .all()
-    )
+    total = get_book_count(db, section_value)
 
-    # ✅ Normalizar URLs de imágenes
-    for book in books:
-        if book.image_url and not book.image_url.startswith("http"):
-            book.image_url = f"{BASE_URL}/{book.image_url}"
+    # 🧭 Keyset: continuar después del último id visto, sin OFFSET
+    if cursor:
+        cursor_section, last_id = decode_cursor(cursor)
+        if cursor_section != section_value:
+            raise HTTPException(status_code=400, detail="Cursor does not match section filter")
+        query = query.filter(models.Book.id > last_id).order_by(models.Book.id)
+    else:
+        query = query.order_by(models.Book.id).offset((page - 1) * limit)
 
-    return {
+    # Se pide una fila de más para saber si hay página siguiente
+    rows = query.limit(limit + 1).all()
+    books = rows[:limit]
+
+    if selected:
+        books = [dict(row._mapping) for row in books]
+
+    next_cursor = None
+    headers = {}
+    if len(rows) > limit:
+        next_cursor = encode_cursor(section_value, rows[limit - 1].id)
+        next_url = request.url.remove_query_params("page").include_query_params(
+            cursor=next_cursor, limit=limit
+        )
+        headers["Link"] = f'<{next_url}>; rel="next"'
+
+    # Se serializa una sola vez y se guardan los bytes: los hits no vuelven a pasar por Pydantic
+    envelope = schemas.PaginatedBookSummaries if selected else schemas.PaginatedBooks
+    body = envelope.model_validate({
         "items": books,
         "total": total,
         "page": page,
         "pages": math.ceil(total / limit),
-        "limit": limit
+        "limit": limit,
+        "next_cursor": next_cursor,
+    }).model_dump_json(exclude_unset=bool(selected))
+    catalog_cache.set(cache_key, (body, headers))
+    if catalog_version(db, section_value) != version:
+        # Hubo un commit durante la consulta: la página puede estar desactualizada
+        catalog_cache.delete(cache_key)
+    return Response(content=body, media_type="application/json", headers={**headers, **etag_headers(etag)})
+
+
+# -------------------------------
+# 🔎 Buscar libros (FTS5)
+# -------------------------------
+@router.get("/search", response_model=schemas.PaginatedSearchResults)
+def search(
+    q: str = Query(..., min_length=1),
+    page: int = Query(1, ge=1),
+    limit: int = Query(12, ge=1, le=100),
+    db: Session = Depends(get_db),
+):
+    """
+    Búsqueda de texto completo sobre título, autor y descripción.
+    Resultados ordenados por relevancia (BM25) y con las coincidencias resaltadas.
+    """
+    if not search_available(db):
+        raise HTTPException(status_code=501, detail="Search is not available for this database")
+
+    match = build_match_query(q)
+    total, hits = search_books(db, match, limit, (page - 1) * limit) if match else (0, [])
+
+    books = {}
+    if hits:
+        ids = [hit["id"] for hit in hits]
+        books = {book.id: book for book in db.query(models.Book).filter(models.Book.id.in_(ids))}
+
+    items = []
+    for hit in hits:
+        book = books.get(hit.pop("id"))
+        if book is not None:
+            columns = (*BOOK_FIELDS, "image_variants", *IMAGE_FIELDS)
+            items.append({**{name: getattr(book, name) for name in columns}, "highlight": hit})
+
+    return {
+        "items": items,
+        "total": total,
+        "page": page,
+        "pages": math.ceil(total / limit),
+        "limit": limit,
     }
 
 
@@ -125,12 +371,15 @@ async def update_book(
     if not db_book:
         raise HTTPException(status_code=404, detail="Book not found")
 
-    # 📸 Subir nueva imagen si aplica
+    # 📸 Subir nueva imagen si aplica (la anterior pierde una referencia)
+    unused_key = None
+    stored = None
     if image and image.filename:
-        file_path = os.path.join(UPLOAD_DIR, image.filename)
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(image.file, buffer)
-        db_book.image_url = f"{BASE_URL}/{file_path}"
+        stored = await store_upload(image)
+        acquire_asset(db, stored.key, stored.sha256, stored.size)
+        unused_key = release_asset(db, db_book.image_url)
+        for name, value in cover_columns(stored).items():
+            setattr(db_book, name, value)
 
     # 🧩 Actualizar campos
     db_book.title = title
@@ -138,9 +387,17 @@ async def update_book(
     db_book.description = description
     db_book.year = year
     db_book.price = price
-    db_book.section = section.value if section else None
+    new_section = section.value if section else None
+    old_section = db_book.section
+    move_book_count(db, old_section, new_section)
+    db_book.section = new_section
+    bump_catalog_version(db, old_section, new_section)
 
     db.commit()
+    catalog_changed(old_section, new_section)
+    delete_unused_asset(db, unused_key)
+    if stored:
+        schedule_derivatives(db.get_bind(), stored.key, on_ready=lambda sections: catalog_changed(*sections))
     db.refresh(db_book)
     return db_book
 
@@ -155,10 +412,27 @@ def delete_book(book_id: int, db: Session = Depends(get_db)):
     if not db_book:
         raise HTTPException(status_code=404, detail="Book not found")
 
-    # 🧹 Eliminar archivo físico si existe
-    if db_book.image_url and os.path.exists(db_book.image_url.replace(BASE_URL + "/", "")):
-        os.remove(db_book.image_url.replace(BASE_URL + "/", ""))
+    # 🧹 Soltar la imagen: el fichero se borra si ningún otro libro la usa
+    unused_key = release_asset(db, db_book.image_url)
 
     db.delete(db_book)
+    adjust_book_count(db, db_book.section, -1)
+    bump_catalog_version(db, db_book.section)
     db.commit()
+    catalog_changed(db_book.section)
+    delete_unused_asset(db, unused_key)
     return {"message": "Book deleted successfully"}
+
+
+# -------------------------------
+# 🧮 Recalcular contadores (admin)
+# -------------------------------
+@router.post("/counters/rebuild")
+def rebuild_counters(db: Session = Depends(get_db), admin: Principal = Depends(get_current_admin)):
+    """Recalcular los contadores por sección desde la tabla de libros"""
+    counts = rebuild_book_counts(db)
+    # Los totales pueden haber cambiado en cualquier sección
+    bump_catalog_version(db, *(key for key in counts if key != ALL_SECTIONS))
+    db.commit()
+    catalog_cache.clear()
+    return {"counts": counts}
@@ -1,18 +1,33 @@
 # app/routes_cart.py
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, joinedload
 from typing import List
 
 from app import models, schemas
 from app.database import get_db
+from app.versions import bump_cart_version, cart_version, catalog_version, etag_headers, make_etag, not_modified
 
 router = APIRouter(prefix="/cart", tags=["cart"])
 
 
 @router.get("/{user_id}", response_model=List[schemas.CartItemResponse])
-def get_cart(user_id: int, db: Session = Depends(get_db)):
+def get_cart(user_id: int, request: Request, response: Response, db: Session = Depends(get_db)):
+    """
+    Carrito con los libros. Con `If-None-Match` vigente se responde 304 desde las versiones en
+    memoria (`app.versions`): sin consultar la DB mientras no caduquen (VERSION_CACHE_TTL).
+    """
+    # El carrito incluye datos de los libros: depende también de la versión del catálogo
+    etag = make_etag("cart", user_id, cart_version(db, user_id), catalog_version(db))
+    unchanged = not_modified(request, etag)
+    if unchanged is not None:
+        return unchanged
+
+    response.headers.update(etag_headers(etag))
+    # Libro en el mismo SELECT (INNER JOIN: book_id es NOT NULL); sin él, una consulta por línea
     cart_items = (
         db.query(models.CartItem)
+        .options(joinedload(models.CartItem.book, innerjoin=True))
         .filter(models.CartItem.user_id == user_id)
         .all()
     )
@@ -40,7 +55,13 @@ def add_to_cart(item: schemas.CartItemCreate, db: Session = Depends(get_db)):
 
     cart_item = models.CartItem(user_id=item.user_id, book_id=item.book_id)
     db.add(cart_item)
-    db.commit()
+    bump_cart_version(db, item.user_id)
+    try:
+        db.commit()
+    except IntegrityError:
+        # Otra petición lo añadió a la vez (índice único user_id + book_id)
+        db.rollback()
+        raise HTTPException(status_code=400, detail="El libro ya está en el carrito")
     db.refresh(cart_item)
     return cart_item
 
@@ -56,6 +77,7 @@ def remove_from_cart(user_id: int, book_id: int, db: Session = Depends(get_db)):
         raise HTTPException(status_code=404, detail="Item no encontrado en el carrito")
 
     db.delete(item)
+    bump_cart_version(db, user_id)
     db.commit()
     return {"message": "Libro eliminado del carrito"}
 
@@ -63,5 +85,6 @@ def remove_from_cart(user_id: int, book_id: int, db: Session = Depends(get_db)):
 @router.delete("/{user_id}/clear")
 def clear_cart(user_id: int, db: Session = Depends(get_db)):
     deleted = db.query(models.CartItem).filter(models.CartItem.user_id == user_id).delete()
+    bump_cart_version(db, user_id)
     db.commit()
     return {"message": f"Carrito vaciado ({deleted} elementos eliminados)"}
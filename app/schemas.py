@@ -1,7 +1,10 @@
-from pydantic import BaseModel, HttpUrl
-from typing import Optional, Union, List
+from pydantic import BaseModel, Field, HttpUrl, field_serializer, model_validator
+from typing import Dict, Optional, Union, List
 from enum import Enum
 
+from app.assets import public_url
+from app.covers import build_srcset
+
 # ==========================================================
 # Enums
 # ==========================================================
@@ -72,9 +75,26 @@ class BookUpdate(BaseModel):
 
 class BookResponse(BookBase):
     id: int
+    image_variants: Optional[str] = Field(None, exclude=True)
+    image_srcset: Optional[Dict[str, str]] = None  # tipo MIME -> srcset de los derivados
+    image_width: Optional[int] = None
+    image_height: Optional[int] = None
+    image_color: Optional[str] = None  # color dominante "#rrggbb"
+    image_blurhash: Optional[str] = None  # placeholder https://blurha.sh
 
     model_config = {"from_attributes": True}
 
+    @field_serializer("image_url")
+    def serialize_image_url(self, image_url):
+        # En DB se guarda la clave relativa; la URL pública se resuelve al serializar
+        return public_url(str(image_url)) if image_url else None
+
+    @model_validator(mode="after")
+    def resolve_srcset(self):
+        if self.image_variants:
+            self.image_srcset = build_srcset(str(self.image_url), self.image_variants)
+        return self
+
 # ==========================================================
 # Cart Items
 # ==========================================================
@@ -100,6 +120,54 @@ class CartItemResponse(BaseModel):
 class PaginatedBooks(BaseModel):
     total: int
     page: int
+    pages: int
     limit: int
     items: List[BookResponse]
+    next_cursor: Optional[str] = None  # cursor opaco para la página siguiente (keyset)
+
+
+class BookSummary(BaseModel):
+    """Libro con solo los campos pedidos en `fields=` (los no pedidos no se serializan)."""
+    id: int
+    title: Optional[str] = None
+    author: Optional[str] = None
+    description: Optional[str] = None
+    year: Optional[int] = None
+    image_url: Optional[Union[str, HttpUrl]] = None
+    section: Optional[SectionEnum] = None
+    price: Optional[float] = None
+    image_variants: Optional[str] = Field(None, exclude=True)
+    image_srcset: Optional[Dict[str, str]] = None
+    image_width: Optional[int] = None
+    image_height: Optional[int] = None
+    image_color: Optional[str] = None
+    image_blurhash: Optional[str] = None
+
+    @field_serializer("image_url")
+    def serialize_image_url(self, image_url):
+        return public_url(str(image_url)) if image_url else None
+
+    @model_validator(mode="after")
+    def resolve_srcset(self):
+        # Solo si se pidió image_url (image_variants viaja con ella)
+        if self.image_variants:
+            self.image_srcset = build_srcset(str(self.image_url), self.image_variants)
+        return self
+
+class PaginatedBookSummaries(PaginatedBooks):
+    items: List[BookSummary]
+
+# ==========================================================
+# Búsqueda de Libros
+# ==========================================================
+
+class BookHighlight(BaseModel):
+    title: Optional[str] = None
+    author: Optional[str] = None
+    description: Optional[str] = None  # fragmento alrededor de las coincidencias
+
+class BookSearchHit(BookResponse):
+    highlight: BookHighlight
 
+class PaginatedSearchResults(PaginatedBooks):
+    items: List[BookSearchHit]
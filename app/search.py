@@ -0,0 +1,128 @@
+# app/search.py
+from sqlalchemy import event, text
+from sqlalchemy.orm import Session
+from typing import List, Optional, Tuple
+import html
+import re
+
+from app.database import Base
+
+# Índice FTS5 de "contenido externo": no duplica el texto, lo lee de `books` por rowid.
+# Los triggers lo mantienen sincronizado con cualquier INSERT/UPDATE/DELETE sobre `books`.
+_FTS_TABLE = """
+CREATE VIRTUAL TABLE IF NOT EXISTS books_fts USING fts5(
+    title, author, description,
+    content='books', content_rowid='id',
+    tokenize='unicode61 remove_diacritics 2'
+)
+"""
+
+_FTS_TRIGGERS = [
+    """
+    CREATE TRIGGER IF NOT EXISTS books_fts_ai AFTER INSERT ON books BEGIN
+        INSERT INTO books_fts(rowid, title, author, description)
+        VALUES (new.id, new.title, new.author, new.description);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS books_fts_ad AFTER DELETE ON books BEGIN
+        INSERT INTO books_fts(books_fts, rowid, title, author, description)
+        VALUES ('delete', old.id, old.title, old.author, old.description);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS books_fts_au AFTER UPDATE OF title, author, description ON books BEGIN
+        INSERT INTO books_fts(books_fts, rowid, title, author, description)
+        VALUES ('delete', old.id, old.title, old.author, old.description);
+        INSERT INTO books_fts(rowid, title, author, description)
+        VALUES (new.id, new.title, new.author, new.description);
+    END
+    """,
+]
+
+HIGHLIGHT_OPEN = "<mark>"
+HIGHLIGHT_CLOSE = "</mark>"
+
+# FTS5 marca las coincidencias con estos caracteres de control; el texto se escapa en Python
+# y después se cambian por <mark>: el HTML que venga en los libros nunca llega sin escapar
+_SENTINEL_OPEN = "\x02"
+_SENTINEL_CLOSE = "\x03"
+
+
+def _escape_highlight(value: Optional[str]) -> Optional[str]:
+    if value is None:
+        return None
+    return (
+        html.escape(value)
+        .replace(_SENTINEL_OPEN, HIGHLIGHT_OPEN)
+        .replace(_SENTINEL_CLOSE, HIGHLIGHT_CLOSE)
+    )
+
+
+@event.listens_for(Base.metadata, "after_create")
+def install_search_index(target, connection, **kw) -> None:
+    """Crea la tabla FTS5 y sus triggers (idempotente). Si la tabla es nueva, indexa los libros existentes."""
+    # `books` aún no registrada (importación circular models <-> database) o DB no SQLite
+    if connection.dialect.name != "sqlite" or "books" not in target.tables:
+        return
+
+    exists = connection.exec_driver_sql(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'books_fts'"
+    ).first()
+    connection.exec_driver_sql(_FTS_TABLE)
+    for trigger in _FTS_TRIGGERS:
+        connection.exec_driver_sql(trigger)
+    if not exists:
+        # `rank` = BM25 con más peso para el título que para el autor y la descripción
+        connection.exec_driver_sql("INSERT INTO books_fts(books_fts, rank) VALUES ('rank', 'bm25(10.0, 5.0, 1.0)')")
+        connection.exec_driver_sql("INSERT INTO books_fts(books_fts) VALUES ('rebuild')")
+
+
+def search_available(db: Session) -> bool:
+    return db.get_bind().dialect.name == "sqlite"
+
+
+def build_match_query(q: str) -> Optional[str]:
+    """
+    Convierte el texto del usuario en una expresión MATCH segura:
+    cada palabra entre comillas (sin operadores FTS) y la última como prefijo.
+    """
+    terms = re.findall(r"\w+", q)
+    if not terms:
+        return None
+    quoted = [f'"{term}"' for term in terms]
+    quoted[-1] += "*"
+    return " ".join(quoted)
+
+
+def search_books(db: Session, match: str, limit: int, offset: int) -> Tuple[int, List[dict]]:
+    """
+    Devuelve `(total, hits)` ordenados por BM25. Cada hit trae el `id` del libro
+    y los campos resaltados (`title`, `author`) y un fragmento de `description`,
+    como HTML escapado con las coincidencias entre `<mark>`.
+    """
+    total = db.execute(
+        text("SELECT count(*) FROM books_fts WHERE books_fts MATCH :match"),
+        {"match": match},
+    ).scalar()
+
+    rows = db.execute(
+        text(
+            """
+            SELECT rowid AS id,
+                   highlight(books_fts, 0, :open, :close) AS title,
+                   highlight(books_fts, 1, :open, :close) AS author,
+                   snippet(books_fts, 2, :open, :close, '…', 16) AS description
+            FROM books_fts
+            WHERE books_fts MATCH :match
+            ORDER BY rank
+            LIMIT :limit OFFSET :offset
+            """
+        ),
+        {"match": match, "open": _SENTINEL_OPEN, "close": _SENTINEL_CLOSE, "limit": limit, "offset": offset},
+    ).mappings().all()
+    hits = [
+        {"id": row["id"], **{name: _escape_highlight(row[name]) for name in ("title", "author", "description")}}
+        for row in rows
+    ]
+    return total, hits
@@ -0,0 +1,140 @@
+# app/static.py
+from fastapi.staticfiles import StaticFiles
+from starlette.datastructures import Headers
+from starlette.exceptions import HTTPException
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import FileResponse, Response, StreamingResponse
+from starlette.staticfiles import NotModifiedResponse
+from starlette.types import Scope
+from email.utils import formatdate
+from typing import List, Optional, Tuple
+import hashlib
+import mimetypes
+import os
+
+from app.assets import IMMUTABLE_CACHE_CONTROL, is_content_addressed
+from app.storage import Storage
+
+# Cache-Control para lo que no está direccionado por contenido
+ASSET_DEFAULT_CACHE_CONTROL = os.getenv("ASSET_DEFAULT_CACHE_CONTROL", "public, max-age=3600")
+
+# Reglas por prefijo de ruta: "books/=public, max-age=86400;otros/=no-cache"
+ASSET_CACHE_RULES = os.getenv("ASSET_CACHE_RULES", "")
+
+# Delegar el envío del fichero al servidor web de delante: "" (lo envía Python), "x-accel" (nginx)
+# o "x-sendfile" (Apache/lighttpd)
+ASSET_SENDFILE = os.getenv("ASSET_SENDFILE", "")
+
+# Location `internal` de nginx que apunta al directorio de subidas (modo x-accel)
+ASSET_ACCEL_PREFIX = os.getenv("ASSET_ACCEL_PREFIX", "/protected-uploads").rstrip("/")
+
+
+def parse_cache_rules(rules: str) -> List[Tuple[str, str]]:
+    """`"a/=v1;b/=v2"` -> `[("a/", "v1"), ("b/", "v2")]`"""
+    parsed = []
+    for rule in rules.split(";"):
+        prefix, sep, value = rule.partition("=")
+        if sep and prefix.strip() and value.strip():
+            parsed.append((prefix.strip(), value.strip()))
+    return parsed
+
+
+class AssetStaticFiles(StaticFiles):
+    """
+    StaticFiles para /uploads:
+    - ETag fuerte: el hash del nombre en ficheros direccionados por contenido (igual en todas las réplicas)
+    - Cache-Control por ruta: `immutable` para contenido direccionado, reglas por prefijo para el resto
+    - Rangos de bytes (los resuelve FileResponse) o entrega delegada con X-Accel-Redirect / X-Sendfile
+    - Los directorios ocultos (subidas a medias) no se exponen
+    Con un almacenamiento sin directorio local (S3) el fichero se lee del backend en streaming.
+    """
+
+    def __init__(
+        self,
+        *args,
+        storage: Optional[Storage] = None,
+        sendfile: Optional[str] = None,
+        accel_prefix: Optional[str] = None,
+        cache_rules: Optional[str] = None,
+        **kwargs,
+    ):
+        self.storage = None
+        if storage is not None:
+            if storage.local_root is not None:
+                kwargs["directory"] = storage.local_root
+            else:
+                self.storage = storage  # remoto: no hay directorio que servir
+        super().__init__(*args, **kwargs)
+        self.sendfile = ASSET_SENDFILE if sendfile is None else sendfile
+        self.accel_prefix = ASSET_ACCEL_PREFIX if accel_prefix is None else accel_prefix.rstrip("/")
+        self.cache_rules = parse_cache_rules(ASSET_CACHE_RULES if cache_rules is None else cache_rules)
+
+    async def get_response(self, path: str, scope: Scope) -> Response:
+        if any(part.startswith(".") for part in path.split("/")):
+            raise HTTPException(status_code=404)
+        if self.storage is not None:
+            return await self.storage_response(path.replace(os.sep, "/"), scope)
+        return await super().get_response(path, scope)
+
+    def cache_control(self, path: str) -> str:
+        if is_content_addressed(path):
+            return IMMUTABLE_CACHE_CONTROL
+        for prefix, value in self.cache_rules:
+            if path.startswith(prefix):
+                return value
+        return ASSET_DEFAULT_CACHE_CONTROL
+
+    def etag(self, path: str, fallback: str) -> str:
+        if is_content_addressed(path):
+            # El nombre ya es el hash del contenido: ETag estable aunque cambie el mtime
+            return f'"{os.path.splitext(os.path.basename(path))[0]}"'
+        return fallback
+
+    def file_response(self, full_path, stat_result: os.stat_result, scope: Scope, status_code: int = 200) -> Response:
+        path = os.path.relpath(full_path, self.directory).replace(os.sep, "/")
+        etag_base = f"{stat_result.st_mtime_ns}-{stat_result.st_size}-{stat_result.st_ino}"
+        headers = {
+            "Cache-Control": self.cache_control(path),
+            "ETag": self.etag(path, f'"{hashlib.sha1(etag_base.encode()).hexdigest()}"'),
+        }
+
+        if self.sendfile:
+            response = self._delegated_response(path, full_path, stat_result, headers, status_code)
+        else:
+            response = FileResponse(full_path, status_code=status_code, stat_result=stat_result, headers=headers)
+
+        if self.is_not_modified(response.headers, Headers(scope=scope)):
+            return NotModifiedResponse(response.headers)
+        return response
+
+    def _delegated_response(self, path: str, full_path, stat_result, headers: dict, status_code: int) -> Response:
+        """Respuesta vacía: el servidor web de delante envía el fichero (con sendfile y rangos)."""
+        media_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+        if self.sendfile == "x-accel":
+            headers["X-Accel-Redirect"] = f"{self.accel_prefix}/{path}"
+        else:
+            headers["X-Sendfile"] = os.path.abspath(full_path)
+        # Last-Modified para que If-Modified-Since siga funcionando
+        headers["Last-Modified"] = formatdate(stat_result.st_mtime, usegmt=True)
+        return Response(status_code=status_code, media_type=media_type, headers=headers)
+
+    async def storage_response(self, key: str, scope: Scope) -> Response:
+        """Sirve `key` desde el almacenamiento remoto, por trozos (sin rangos de bytes)."""
+        if scope["method"] not in ("GET", "HEAD"):
+            raise HTTPException(status_code=405, headers={"Allow": "GET, HEAD"})
+        stored = await run_in_threadpool(self.storage.stat, key)
+        if stored is None:
+            raise HTTPException(status_code=404)
+
+        headers = {
+            "Cache-Control": self.cache_control(key),
+            "ETag": self.etag(key, stored.etag or f'"{stored.size}-{stored.mtime}"'),
+            "Last-Modified": formatdate(stored.mtime, usegmt=True),
+        }
+        if self.is_not_modified(Headers(headers), Headers(scope=scope)):
+            return NotModifiedResponse(Headers(headers))
+        headers["Content-Length"] = str(stored.size)
+        media_type = mimetypes.guess_type(key)[0] or "application/octet-stream"
+        if scope["method"] == "HEAD":
+            return Response(media_type=media_type, headers=headers)
+        return StreamingResponse(self.storage.open(key), media_type=media_type, headers=headers)
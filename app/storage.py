@@ -0,0 +1,293 @@
+# app/storage.py
+# Almacenamiento de las imágenes subidas: disco local o un bucket compatible con S3.
+# Las claves son rutas relativas (`books/ab/cd/<sha256>.jpg`) iguales en ambos backends.
+from abc import ABC, abstractmethod
+from typing import Iterable, Iterator, NamedTuple, Optional
+import os
+import tempfile
+import threading
+
+try:
+    import boto3
+    from boto3.s3.transfer import TransferConfig
+    from botocore.config import Config
+    from botocore.exceptions import ClientError
+except ImportError:  # boto3 solo hace falta con ASSET_STORAGE=s3
+    boto3 = None
+
+# "local" (directorio UPLOAD_ROOT) o "s3" (bucket compartido por todas las réplicas)
+ASSET_STORAGE = os.getenv("ASSET_STORAGE", "local")
+
+# 📂 Raíz local de los ficheros subidos (se sirve en /uploads)
+UPLOAD_ROOT = os.getenv("UPLOAD_ROOT", "uploads")
+
+# Bucket S3 y, opcionalmente, endpoint de un servicio compatible (MinIO, R2...)
+ASSET_S3_BUCKET = os.getenv("ASSET_S3_BUCKET", "")
+ASSET_S3_ENDPOINT_URL = os.getenv("ASSET_S3_ENDPOINT_URL") or None
+ASSET_S3_REGION = os.getenv("ASSET_S3_REGION") or None
+
+# Prefijo de las claves dentro del bucket ("" = raíz)
+ASSET_S3_PREFIX = os.getenv("ASSET_S3_PREFIX", "")
+
+# Conexiones HTTP reutilizables del cliente S3 (compartido entre hilos)
+ASSET_S3_POOL_SIZE = int(os.getenv("ASSET_S3_POOL_SIZE", "32"))
+
+# Tamaño de cada parte de la subida multipart (mínimo 5 MB en S3)
+ASSET_S3_PART_SIZE = int(os.getenv("ASSET_S3_PART_SIZE", str(8 * 1024 * 1024)))
+
+# Tamaño de cada trozo leído al servir un fichero
+READ_CHUNK_SIZE = 64 * 1024
+
+
+class StoredObject(NamedTuple):
+    key: str
+    size: int
+    mtime: float          # epoch (segundos)
+    etag: Optional[str]   # ETag del backend, si lo tiene
+
+
+def remove_file(path: str) -> None:
+    """Borra un fichero local (temporales de subida, claves de LocalStorage); si no existe, no pasa nada."""
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+class Storage(ABC):
+    """
+    Interfaz de almacenamiento. Las subidas se escriben primero en `temp_dir()` (mientras se
+    calcula su hash) y después `publish` las mueve a su clave definitiva.
+    """
+
+    # Directorio local con las claves, si el backend lo tiene (permite servir con sendfile)
+    local_root: Optional[str] = None
+
+    @abstractmethod
+    def temp_dir(self) -> str:
+        ...
+
+    @abstractmethod
+    def publish(self, tmp_path: str, key: str, content_type: Optional[str] = None,
+                cache_control: Optional[str] = None) -> bool:
+        """Guarda `tmp_path` como `key` y borra el temporal. Devuelve True si `key` ya existía."""
+        ...
+
+    @abstractmethod
+    def download(self, key: str, path: str) -> None:
+        ...
+
+    @abstractmethod
+    def stat(self, key: str) -> Optional[StoredObject]:
+        ...
+
+    @abstractmethod
+    def open(self, key: str) -> Iterator[bytes]:
+        """Contenido de `key` por trozos."""
+        ...
+
+    @abstractmethod
+    def list(self, prefix: str) -> Iterator[StoredObject]:
+        """Objetos cuya clave empieza por `prefix`, en orden de clave."""
+        ...
+
+    @abstractmethod
+    def delete(self, keys: Iterable[str]) -> None:
+        """Borra `keys`; las que no existen se ignoran."""
+        ...
+
+
+class LocalStorage(Storage):
+    def __init__(self, root: str):
+        self.local_root = root
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.local_root, key)
+
+    def temp_dir(self) -> str:
+        # Dentro de la raíz: mismo sistema de ficheros, así publicar es un rename atómico
+        return os.path.join(self.local_root, ".tmp")
+
+    def publish(self, tmp_path, key, content_type=None, cache_control=None) -> bool:
+        path = self._path(key)
+        if os.path.exists(path):
+            # Mismo contenido ya guardado: basta con la copia existente. Se renueva su mtime
+            # para que el GC no la borre antes de que el libro que la usa haga commit.
+            os.remove(tmp_path)
+            os.utime(path)
+            return True
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(tmp_path, path)
+        return False
+
+    def download(self, key, path) -> None:
+        with open(self._path(key), "rb") as source, open(path, "wb") as target:
+            while chunk := source.read(READ_CHUNK_SIZE):
+                target.write(chunk)
+
+    def stat(self, key) -> Optional[StoredObject]:
+        try:
+            result = os.stat(self._path(key))
+        except FileNotFoundError:
+            return None
+        return StoredObject(key, result.st_size, result.st_mtime, None)
+
+    def open(self, key) -> Iterator[bytes]:
+        with open(self._path(key), "rb") as source:
+            while chunk := source.read(READ_CHUNK_SIZE):
+                yield chunk
+
+    def list(self, prefix) -> Iterator[StoredObject]:
+        directory = prefix.rsplit("/", 1)[0] if "/" in prefix else ""
+        return self._walk(directory, prefix)
+
+    def _walk(self, directory: str, prefix: str) -> Iterator[StoredObject]:
+        try:
+            entries = sorted(os.scandir(self._path(directory)), key=lambda entry: entry.name)
+        except FileNotFoundError:
+            return
+        for entry in entries:
+            if entry.name.startswith("."):
+                continue  # subidas a medias
+            key = f"{directory}/{entry.name}" if directory else entry.name
+            if entry.is_dir():
+                if key.startswith(prefix) or prefix.startswith(key + "/"):
+                    yield from self._walk(key, prefix)
+            elif key.startswith(prefix):
+                result = entry.stat()
+                yield StoredObject(key, result.st_size, result.st_mtime, None)
+
+    def delete(self, keys) -> None:
+        for key in keys:
+            remove_file(self._path(key))
+
+
+class S3Storage(Storage):
+    """
+    Bucket S3 (o compatible). Un único cliente boto3, seguro entre hilos, con su pool de
+    conexiones; las subidas grandes van en multipart con partes de ASSET_S3_PART_SIZE.
+    """
+
+    def __init__(self, bucket: str, prefix: str = "", endpoint_url: Optional[str] = None,
+                 region: Optional[str] = None, pool_size: int = ASSET_S3_POOL_SIZE,
+                 part_size: int = ASSET_S3_PART_SIZE):
+        if boto3 is None:
+            raise RuntimeError("ASSET_STORAGE=s3 requires boto3")
+        self.bucket = bucket
+        self.prefix = prefix
+        self.endpoint_url = endpoint_url
+        self.region = region
+        self.pool_size = pool_size
+        self.part_size = part_size
+        self._client = None
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        # Se envía a los procesos de derivados: cada proceso crea su propio cliente
+        state = self.__dict__.copy()
+        state["_client"] = None
+        state["_lock"] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        with self._lock:
+            if self._client is None:
+                self._client = boto3.client(
+                    "s3",
+                    endpoint_url=self.endpoint_url,
+                    region_name=self.region,
+                    config=Config(max_pool_connections=self.pool_size, retries={"mode": "standard"}),
+                )
+            return self._client
+
+    def _object_key(self, key: str) -> str:
+        return f"{self.prefix}{key}"
+
+    def temp_dir(self) -> str:
+        return os.path.join(tempfile.gettempdir(), "librium-uploads")
+
+    def publish(self, tmp_path, key, content_type=None, cache_control=None) -> bool:
+        extra = {}
+        if content_type:
+            extra["ContentType"] = content_type
+        if cache_control:
+            extra["CacheControl"] = cache_control
+        try:
+            if self.stat(key) is not None:
+                # Ya existe: se copia sobre sí mismo para renovar LastModified (ver GC)
+                self.client.copy_object(
+                    Bucket=self.bucket,
+                    Key=self._object_key(key),
+                    CopySource={"Bucket": self.bucket, "Key": self._object_key(key)},
+                    MetadataDirective="REPLACE",
+                    **extra,
+                )
+                return True
+            transfer = TransferConfig(
+                multipart_threshold=self.part_size, multipart_chunksize=self.part_size, max_concurrency=4
+            )
+            self.client.upload_file(tmp_path, self.bucket, self._object_key(key), ExtraArgs=extra, Config=transfer)
+            return False
+        finally:
+            try:
+                os.remove(tmp_path)
+            except FileNotFoundError:
+                pass
+
+    def download(self, key, path) -> None:
+        self.client.download_file(self.bucket, self._object_key(key), path)
+
+    def stat(self, key) -> Optional[StoredObject]:
+        try:
+            head = self.client.head_object(Bucket=self.bucket, Key=self._object_key(key))
+        except ClientError as exc:
+            if exc.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                return None
+            raise
+        return StoredObject(key, head["ContentLength"], head["LastModified"].timestamp(), head.get("ETag"))
+
+    def open(self, key) -> Iterator[bytes]:
+        body = self.client.get_object(Bucket=self.bucket, Key=self._object_key(key))["Body"]
+        try:
+            yield from body.iter_chunks(READ_CHUNK_SIZE)
+        finally:
+            body.close()
+
+    def list(self, prefix) -> Iterator[StoredObject]:
+        paginator = self.client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self._object_key(prefix)):
+            for item in page.get("Contents", []):
+                key = item["Key"][len(self.prefix):]
+                yield StoredObject(key, item["Size"], item["LastModified"].timestamp(), item.get("ETag"))
+
+    def delete(self, keys) -> None:
+        keys = list(keys)
+        for start in range(0, len(keys), 1000):  # máximo de DeleteObjects
+            self.client.delete_objects(
+                Bucket=self.bucket,
+                Delete={"Objects": [{"Key": self._object_key(key)} for key in keys[start:start + 1000]], "Quiet": True},
+            )
+
+
+_storage: Optional[Storage] = None
+_storage_lock = threading.Lock()
+
+
+def get_storage() -> Storage:
+    """Backend configurado por ASSET_STORAGE (se crea una sola vez por proceso)."""
+    global _storage
+    with _storage_lock:
+        if _storage is None:
+            if ASSET_STORAGE == "s3":
+                _storage = S3Storage(
+                    ASSET_S3_BUCKET, ASSET_S3_PREFIX, endpoint_url=ASSET_S3_ENDPOINT_URL, region=ASSET_S3_REGION
+                )
+            else:
+                _storage = LocalStorage(UPLOAD_ROOT)
+        return _storage
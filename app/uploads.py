@@ -0,0 +1,157 @@
+# app/uploads.py
+from fastapi import HTTPException, UploadFile
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse
+from typing import NamedTuple, Optional
+import hashlib
+import os
+import uuid
+
+from app.assets import IMMUTABLE_CACHE_CONTROL
+from app.images import ImageInfo, describe_image
+from app.storage import get_storage, remove_file
+
+# Tamaño máximo de una imagen subida (bytes)
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(5 * 1024 * 1024)))
+
+# Margen de un cuerpo multipart sobre la imagen: campos del formulario, cabeceras de cada parte
+MULTIPART_OVERHEAD_BYTES = int(os.getenv("MULTIPART_OVERHEAD_BYTES", str(64 * 1024)))
+
+# Tamaño de cada trozo leído de la petición y escrito a disco
+CHUNK_SIZE = 64 * 1024
+
+# Firmas ("magic bytes") de los formatos de imagen aceptados -> extensión
+_SIGNATURES = (
+    (b"\xff\xd8\xff", "jpg"),
+    (b"\x89PNG\r\n\x1a\n", "png"),
+    (b"GIF87a", "gif"),
+    (b"GIF89a", "gif"),
+)
+
+CONTENT_TYPES = {"jpg": "image/jpeg", "png": "image/png", "gif": "image/gif", "webp": "image/webp"}
+
+
+def sniff_image_type(head: bytes) -> Optional[str]:
+    """Devuelve la extensión del formato según los primeros bytes, o None si no es una imagen aceptada."""
+    for signature, extension in _SIGNATURES:
+        if head.startswith(signature):
+            return extension
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "webp"
+    return None
+
+
+class StoredImage(NamedTuple):
+    key: str        # clave en el almacenamiento, p.ej. books/ab/cd/<sha256>.jpg
+    sha256: str
+    size: int
+    extension: str
+    info: Optional[ImageInfo] = None  # dimensiones, color y placeholder (None si Pillow no la decodifica)
+
+
+def cover_columns(stored: StoredImage) -> dict:
+    """Columnas de `Book` que describen una portada recién subida."""
+    info = stored.info
+    return {
+        "image_url": stored.key,
+        "image_variants": None,
+        "image_width": info.width if info else None,
+        "image_height": info.height if info else None,
+        "image_color": info.color if info else None,
+        "image_blurhash": info.blurhash if info else None,
+    }
+
+
+def content_key(prefix: str, sha256: str, extension: str) -> str:
+    """`books/ab/cd/<sha256>.<ext>`: dos niveles de subdirectorio para no llenar uno solo."""
+    return f"{prefix}/{sha256[:2]}/{sha256[2:4]}/{sha256}.{extension}"
+
+
+async def store_upload(upload: UploadFile, prefix: str = "books") -> StoredImage:
+    """
+    Guarda `upload` direccionado por contenido, leyendo y escribiendo por trozos fuera del event loop.
+    Valida el tipo por los magic bytes del primer trozo y corta al superar MAX_UPLOAD_BYTES.
+    El SHA-256 se calcula mientras se escribe a un fichero temporal local, que luego el
+    almacenamiento publica con su clave definitiva (rename en disco, subida multipart en S3);
+    si ese contenido ya existía, el temporal se descarta (deduplicación).
+    """
+    storage = get_storage()
+    first = await upload.read(CHUNK_SIZE)
+    extension = sniff_image_type(first)
+    if extension is None:
+        raise HTTPException(status_code=415, detail="Unsupported image type")
+
+    tmp_dir = storage.temp_dir()
+    os.makedirs(tmp_dir, exist_ok=True)
+    tmp_path = os.path.join(tmp_dir, f"{uuid.uuid4().hex}.part")
+    buffer = await run_in_threadpool(open, tmp_path, "wb")
+    digest = hashlib.sha256()
+    try:
+        size = 0
+        chunk = first
+        while chunk:
+            size += len(chunk)
+            if size > MAX_UPLOAD_BYTES:
+                raise HTTPException(status_code=413, detail="Image too large")
+            await run_in_threadpool(_write_and_hash, buffer, digest, chunk)
+            chunk = await upload.read(CHUNK_SIZE)
+        await run_in_threadpool(buffer.close)
+
+        # Metadatos leídos del temporal (decodificación a escala reducida, en el threadpool)
+        info = await run_in_threadpool(describe_image, tmp_path)
+        sha256 = digest.hexdigest()
+        key = content_key(prefix, sha256, extension)
+        await run_in_threadpool(
+            storage.publish, tmp_path, key, CONTENT_TYPES[extension], IMMUTABLE_CACHE_CONTROL
+        )
+    except BaseException:
+        await run_in_threadpool(buffer.close)
+        await run_in_threadpool(remove_file, tmp_path)
+        raise
+    return StoredImage(key=key, sha256=sha256, size=size, extension=extension, info=info)
+
+
+def _write_and_hash(buffer, digest, chunk: bytes) -> None:
+    buffer.write(chunk)
+    digest.update(chunk)
+
+
+class UploadSizeLimitMiddleware:
+    """
+    Límite de tamaño de los cuerpos multipart *antes* de que Starlette los lea: el formulario se
+    analiza (y el fichero se vuelca a un temporal) antes de llegar a la ruta, así que el límite de
+    `store_upload` llegaría tarde. Con Content-Length excesivo se responde 413 sin leer nada; sin
+    él (chunked) se cuentan los bytes recibidos y se corta al pasar el límite.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not _is_multipart(scope):
+            return await self.app(scope, receive, send)
+
+        limit = MAX_UPLOAD_BYTES + MULTIPART_OVERHEAD_BYTES
+        length = dict(scope["headers"]).get(b"content-length")
+        if length is not None and length.isdigit() and int(length) > limit:
+            response = JSONResponse(status_code=413, content={"detail": "Request body too large"})
+            return await response(scope, receive, send)
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    # FastAPI deja pasar las HTTPException que surgen al leer el cuerpo
+                    raise HTTPException(status_code=413, detail="Request body too large")
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+
+def _is_multipart(scope) -> bool:
+    content_type = dict(scope["headers"]).get(b"content-type", b"")
+    return content_type.startswith(b"multipart/form-data")
@@ -0,0 +1,112 @@
+# app/versions.py
+from fastapi import Request, Response
+from sqlalchemy import event, select
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.orm import Session
+from typing import Dict, Optional
+import hashlib
+import os
+import time
+
+from app import metrics, models
+from app.cache import TTLCache
+
+# Las versiones están en la DB (tabla `data_versions`), no solo en memoria del proceso: un commit
+# en un worker cambia el ETag que calculan todos los demás. Para no consultar la DB en cada 304 o
+# acierto de caché, cada proceso guarda una copia de las versiones leídas durante VERSION_CACHE_TTL
+# segundos. Compromiso deliberado: lo escrito por *otro* worker se ve con hasta ese retraso (hasta
+# entonces puede responder 304 o servir la página cacheada anterior); lo escrito en este proceso se
+# ve al momento (su commit borra la copia). Con VERSION_CACHE_TTL=0 cada petición lee la DB.
+VERSION_CACHE_TTL = float(os.getenv("VERSION_CACHE_TTL", "1"))
+
+# Versiones recordadas (una por sección y por carrito)
+VERSION_CACHE_SIZE = int(os.getenv("VERSION_CACHE_SIZE", "10000"))
+
+version_cache = TTLCache(maxsize=VERSION_CACHE_SIZE, ttl=VERSION_CACHE_TTL)
+metrics.register("version_cache", version_cache.stats)
+
+
+def _read(db: Session, name: str) -> int:
+    if VERSION_CACHE_TTL > 0:
+        cached = version_cache.get(name)
+        if cached is not None:
+            return cached
+    # SELECT explícito (no `db.get`): el identity map de la sesión podría devolver un valor ya leído
+    value = db.execute(select(models.DataVersion.value).where(models.DataVersion.name == name)).scalar() or 0
+    if VERSION_CACHE_TTL > 0:
+        version_cache.set(name, value, ttl=VERSION_CACHE_TTL)
+    return value
+
+
+def _bump(db: Session, name: str) -> None:
+    # La primera versión parte de la hora actual (ms): si la DB se recrea, los ETags
+    # que guardan los clientes no vuelven a coincidir por casualidad.
+    stmt = insert(models.DataVersion).values(name=name, value=int(time.time() * 1000))
+    db.execute(stmt.on_conflict_do_update(
+        index_elements=[models.DataVersion.name],
+        set_={"value": models.DataVersion.value + 1},
+    ))
+    db.info.setdefault("bumped_versions", set()).add(name)
+
+
+@event.listens_for(Session, "after_commit")
+def _forget_bumped_versions(session: Session) -> None:
+    # Tras el commit (no antes: otra petición podría volver a leer el valor viejo)
+    for name in session.info.pop("bumped_versions", ()):
+        version_cache.delete(name)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_bumped_versions(session: Session) -> None:
+    session.info.pop("bumped_versions", None)
+
+
+def catalog_version(db: Session, section: Optional[str] = None) -> int:
+    """Versión del catálogo completo, o solo de una sección (cambia menos)."""
+    return _read(db, f"catalog:{section}" if section else "catalog")
+
+
+def bump_catalog_version(db: Session, *sections: Optional[str]) -> None:
+    """
+    Llamar antes del commit de cualquier cambio en `books` (en su misma transacción),
+    con las secciones de los libros tocados (la anterior y la nueva si cambia).
+    """
+    _bump(db, "catalog")
+    for section in sorted({section for section in sections if section}):
+        _bump(db, f"catalog:{section}")
+
+
+def cart_version(db: Session, user_id: int) -> int:
+    return _read(db, f"cart:{user_id}")
+
+
+def bump_cart_version(db: Session, user_id: int) -> None:
+    """Llamar antes del commit de cualquier cambio en el carrito de `user_id`."""
+    _bump(db, f"cart:{user_id}")
+
+
+def make_etag(*parts) -> str:
+    """ETag fuerte a partir de las versiones (y demás datos) que determinan la representación."""
+    digest = hashlib.sha1("|".join(map(str, parts)).encode()).hexdigest()[:20]
+    return f'"{digest}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    candidates = (tag.strip() for tag in if_none_match.split(","))
+    return any(tag.removeprefix("W/") == etag for tag in candidates)
+
+
+def not_modified(request: Request, etag: str) -> Optional[Response]:
+    """Devuelve una respuesta 304 si el cliente ya tiene esta versión, o None."""
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=etag_headers(etag))
+    return None
+
+
+def etag_headers(etag: str) -> Dict[str, str]:
+    # no-cache: el cliente puede guardar la respuesta pero debe revalidarla (barato: 304)
+    return {"ETag": etag, "Cache-Control": "no-cache"}
@@ -5,9 +5,11 @@ import pytest
 from fastapi.testclient import TestClient
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
 from app.database import Base, get_db
-from app import models
+from app import models, storage
 from app.main import app
+from app.ratelimit import login_limiter
 
 # Crear un engine sqlite en memoria para tests
 TEST_SQLITE_URL = "sqlite:///:memory:"
@@ -15,7 +17,12 @@ TEST_SQLITE_URL = "sqlite:///:memory:"
 
 @pytest.fixture(scope="session")
 def engine():
-    engine = create_engine(TEST_SQLITE_URL, connect_args={"check_same_thread": False})
+    # StaticPool: todas las sesiones comparten la misma conexión (y la misma DB en memoria)
+    engine = create_engine(
+        TEST_SQLITE_URL,
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool,
+    )
     Base.metadata.create_all(bind=engine)
     return engine
 
@@ -43,6 +50,14 @@ def client(db_session, monkeypatch):
             db_session.close()
 
     app.dependency_overrides[get_db] = override_get_db
+    login_limiter.backend.clear()  # todos los tests comparten la IP "testclient"
     with TestClient(app) as c:
         yield c
     app.dependency_overrides.clear()
+
+
+@pytest.fixture()
+def upload_root(tmp_path, monkeypatch):
+    """Redirige las subidas de imágenes a un directorio temporal."""
+    monkeypatch.setattr(storage, "_storage", storage.LocalStorage(str(tmp_path)))
+    return tmp_path
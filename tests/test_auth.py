@@ -23,3 +23,300 @@ def test_register_and_login(client):
     # Check cookie set
     cookies = r2.cookies
     assert "autorizado" in cookies
+
+
+def test_register_and_login_hash_in_process_pool(client):
+    from app import hashing
+
+    r = client.post("/auth/register", json={"username": "pool-user", "password": "Secret123!"})
+    assert r.status_code == 200
+    r = client.post("/auth/login", json={"username": "pool-user", "password": "Secret123!"})
+    assert r.status_code == 200
+    assert "autorizado" in r.cookies
+    assert client.post("/auth/login", json={"username": "pool-user", "password": "wrong"}).status_code == 401
+
+    stats = hashing.stats()
+    assert stats["completed"] >= 3 and stats["pending"] == 0
+
+
+def test_login_rejected_with_retry_after_when_hash_pool_saturated(client, monkeypatch):
+    from app import hashing
+
+    client.post("/auth/register", json={"username": "busy-user", "password": "Secret123!"})
+    monkeypatch.setattr(hashing, "HASH_QUEUE_LIMIT", 0)
+    rejected = hashing.stats()["rejected"]
+
+    r = client.post("/auth/login", json={"username": "busy-user", "password": "Secret123!"})
+    assert r.status_code == 503
+    assert int(r.headers["retry-after"]) >= 1
+    assert hashing.stats()["rejected"] == rejected + 1
+
+
+def test_cancelled_hash_still_counts_until_the_pool_finishes_it():
+    import asyncio
+    import time
+    from app import hashing
+
+    async def scenario():
+        await hashing._run(time.sleep, 0)  # arranca los procesos del pool
+        task = asyncio.create_task(hashing._run(time.sleep, 0.5))
+        await asyncio.sleep(0.2)  # ya en marcha en el proceso
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+        return hashing.stats()["pending"]
+
+    assert asyncio.run(scenario()) == 1  # el cliente se fue, pero el pool sigue ocupado
+    deadline = time.monotonic() + 5
+    while hashing.stats()["pending"] and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert hashing.stats()["pending"] == 0
+
+
+def test_login_rehashes_password_with_calibrated_cost(client, db_session, monkeypatch):
+    from app import hashing, models
+
+    assert hashing.calibrate_rounds(0.000001, min_rounds=4) == 4
+
+    monkeypatch.setattr(hashing, "_rounds", 4)
+    client.post("/auth/register", json={"username": "rehash-user", "password": "Secret123!"})
+    stored_hash = lambda: db_session.query(models.User).filter_by(username="rehash-user").one().hashed_password
+    assert stored_hash().startswith("$2b$04$")
+
+    monkeypatch.setattr(hashing, "_rounds", 5)
+    assert client.post("/auth/login", json={"username": "rehash-user", "password": "Secret123!"}).status_code == 200
+    assert stored_hash().startswith("$2b$05$")
+    assert client.post("/auth/login", json={"username": "rehash-user", "password": "Secret123!"}).status_code == 200
+
+
+def test_legacy_tokens_resolve_user_through_cache(client, engine, db_session):
+    from datetime import datetime, timedelta
+    from sqlalchemy import event
+    from jose import jwt
+    from app import models
+    from app.deps import ALGORITHM, SECRET_KEY, user_cache
+
+    # Token emitido antes de llevar uid/role en los claims: solo `sub`
+    admin = {"username": "cached-admin", "password": "Admin1234!", "role": "admin"}
+    client.post("/auth/register", json=admin)
+    expire = datetime.utcnow() + timedelta(minutes=5)
+    client.cookies.set("autorizado", jwt.encode({"sub": "cached-admin", "exp": expire}, SECRET_KEY, algorithm=ALGORITHM))
+    assert client.get("/metrics").status_code == 200
+
+    statements = []
+    listener = lambda conn, cursor, statement, *args: statements.append(statement)
+    event.listen(engine, "before_cursor_execute", listener)
+    try:
+        assert client.get("/metrics").status_code == 200
+    finally:
+        event.remove(engine, "before_cursor_execute", listener)
+    assert statements == []
+
+    # Al cambiar el usuario se invalida su entrada de caché: el rol nuevo se aplica enseguida
+    user = db_session.query(models.User).filter_by(username="cached-admin").one()
+    user.role = models.UserRole.user
+    db_session.commit()
+    assert user_cache.get("cached-admin") is None
+    assert client.get("/metrics").status_code == 403
+
+
+def test_token_claims_authorize_without_database_and_can_be_revoked(client, engine, db_session):
+    from sqlalchemy import event
+    from jose import jwt
+    from app import models
+    from app.deps import ALGORITHM, SECRET_KEY
+
+    admin = {"username": "claims-admin", "password": "Admin1234!", "role": "admin"}
+    client.post("/auth/register", json=admin)
+    client.post("/auth/login", json=admin)
+    claims = jwt.decode(client.cookies["autorizado"], SECRET_KEY, algorithms=[ALGORITHM])
+    assert claims["role"] == "admin" and claims["uid"] and claims["jti"]
+
+    statements = []
+    listener = lambda conn, cursor, statement, *args: statements.append(statement)
+    event.listen(engine, "before_cursor_execute", listener)
+    try:
+        assert client.get("/metrics").status_code == 200
+    finally:
+        event.remove(engine, "before_cursor_execute", listener)
+    assert statements == []
+
+    # Logout: el token queda revocado aunque se vuelva a presentar
+    token = client.cookies["autorizado"]
+    assert client.post("/auth/logout").status_code == 200
+    client.cookies.set("autorizado", token)
+    assert client.get("/metrics").status_code == 401
+
+    # Cambio de rol: los tokens emitidos antes dejan de valer
+    client.cookies.clear()
+    client.post("/auth/login", json=admin)
+    assert client.get("/metrics").status_code == 200
+    user = db_session.query(models.User).filter_by(username="claims-admin").one()
+    user.role = models.UserRole.user
+    db_session.commit()
+    assert client.get("/metrics").status_code == 401
+    client.post("/auth/login", json=admin)
+    assert client.get("/metrics").status_code == 403
+
+
+def test_login_captcha_uses_overridable_verifier(client):
+    from app.captcha import get_captcha_verifier
+    from app.main import app
+
+    async def reject(token, remote_ip=None):
+        return token == "ok"
+
+    client.post("/auth/register", json={"username": "captcha-user", "password": "Secret123!"})
+    app.dependency_overrides[get_captcha_verifier] = lambda: reject
+    credentials = {"username": "captcha-user", "password": "Secret123!"}
+    assert client.post("/auth/login", json={**credentials, "captchaToken": "bad"}).status_code == 403
+    assert client.post("/auth/login", json={**credentials, "captchaToken": "ok"}).status_code == 200
+
+
+def test_turnstile_circuit_breaker_fails_fast(monkeypatch):
+    import asyncio
+    import httpx
+    from app.captcha import CircuitBreaker, TurnstileVerifier
+
+    calls = []
+
+    def handler(request):
+        calls.append(request)
+        if len(calls) > 2:
+            return httpx.Response(200, json={"success": True})
+        raise httpx.ConnectTimeout("slow", request=request)
+
+    breaker = CircuitBreaker(threshold=2, cooldown=60)
+    verifier = TurnstileVerifier(secret="s", fail_open=False, breaker=breaker, transport=httpx.MockTransport(handler))
+
+    async def scenario():
+        results = [await verifier("token") for _ in range(4)]
+        # Pasado el cooldown entra una petición de prueba, que cierra el circuito
+        breaker.opened_at -= 60
+        results.append(await verifier("token"))
+        await verifier.aclose()
+        return results
+
+    assert asyncio.run(scenario()) == [False, False, False, False, True]
+    assert len(calls) == 3
+    assert verifier.stats()["short_circuited"] == 2 and verifier.stats()["breaker"] == "closed"
+
+    verifier.fail_open = True
+    breaker.record_failure()
+    breaker.record_failure()
+    assert asyncio.run(verifier("token")) is True
+
+
+def test_turnstile_cancelled_probe_does_not_wedge_breaker():
+    import asyncio
+    import httpx
+    from app.captcha import CircuitBreaker, TurnstileVerifier
+
+    release = None
+
+    async def handler(request):
+        if release is not None:
+            await release.wait()  # la petición de prueba se queda colgada hasta que se cancela
+        return httpx.Response(200, json={"success": True})
+
+    breaker = CircuitBreaker(threshold=1, cooldown=0)
+    verifier = TurnstileVerifier(secret="s", fail_open=False, breaker=breaker, transport=httpx.MockTransport(handler))
+
+    async def scenario():
+        nonlocal release
+        release = asyncio.Event()
+        breaker.record_failure()
+        probe = asyncio.create_task(verifier("token"))
+        await asyncio.sleep(0.05)
+        assert breaker._probing
+        probe.cancel()
+        try:
+            await probe
+        except asyncio.CancelledError:
+            pass
+        release = None
+        # La sonda cancelada cuenta como fallo y deja pasar la siguiente prueba, que cierra el circuito
+        result = await verifier("token")
+        await verifier.aclose()
+        return result
+
+    assert asyncio.run(scenario()) is True
+    assert breaker.state == "closed"
+
+
+def test_login_throttled_per_username_before_password_check(client, monkeypatch):
+    from app import hashing
+    from app.ratelimit import login_limiter
+
+    monkeypatch.setattr(login_limiter, "per_user", (3, 60))
+    client.post("/auth/register", json={"username": "stuffed", "password": "Secret123!"})
+    for _ in range(3):
+        assert client.post("/auth/login", json={"username": "stuffed", "password": "guess"}).status_code == 401
+
+    completed = hashing.stats()["completed"]
+    r = client.post("/auth/login", json={"username": "Stuffed", "password": "Secret123!"})
+    assert r.status_code == 429
+    assert 1 <= int(r.headers["retry-after"]) <= 60
+    assert hashing.stats()["completed"] == completed  # bcrypt no llegó a ejecutarse
+
+    # Otro usuario desde la misma IP sigue pudiendo entrar
+    client.post("/auth/register", json={"username": "innocent", "password": "Secret123!"})
+    assert client.post("/auth/login", json={"username": "innocent", "password": "Secret123!"}).status_code == 200
+
+
+def test_login_rejected_by_user_limit_does_not_spend_ip_budget(tmp_path):
+    from app.ratelimit import LoginLimiter, SlidingWindow, SqliteSlidingWindow
+
+    for backend in (SlidingWindow(), SqliteSlidingWindow(str(tmp_path / "ratelimit.db"))):
+        limiter = LoginLimiter(backend, per_user="2/60", per_ip="3/60")
+        assert limiter.check("victim", "10.0.0.1") is None
+        assert limiter.check("victim", "10.0.0.1") is None
+        for _ in range(5):
+            assert limiter.check("victim", "10.0.0.1") is not None  # solo el límite del usuario
+        # La IP solo gastó 2 de 3: otro usuario desde ella aún entra una vez
+        assert limiter.check("other", "10.0.0.1") is None
+        assert limiter.check("other", "10.0.0.1") is not None
+        assert limiter.limited == {"user": 5, "ip": 1}
+
+
+def test_sqlite_sliding_window_is_shared_between_instances(tmp_path):
+    from app.ratelimit import SqliteSlidingWindow
+
+    path = str(tmp_path / "ratelimit.db")
+    worker_a, worker_b = SqliteSlidingWindow(path), SqliteSlidingWindow(path)
+    assert worker_a.hit("ip:1.2.3.4", 2, 60) is None
+    assert worker_b.hit("ip:1.2.3.4", 2, 60) is None
+    assert 0 < worker_a.hit("ip:1.2.3.4", 2, 60) <= 60
+    assert worker_b.hit("ip:5.6.7.8", 2, 60) is None
+    assert worker_b.hit("ip:1.2.3.4", 2, 0.000001) is None  # fuera de la ventana ya no cuentan
+
+
+def test_me_answers_from_claims_without_database(client, engine):
+    from sqlalchemy import event
+    from app.database import get_db
+    from app.main import app
+
+    assert client.get("/auth/me").status_code == 401
+    client.post("/auth/register", json={"username": "me-user", "password": "Secret123!"})
+    client.post("/auth/login", json={"username": "me-user", "password": "Secret123!"})
+
+    def no_session():
+        raise AssertionError("/auth/me must not open a DB session")
+        yield
+
+    # El fixture `client` ya sustituye get_db: hay que sustituir esa sustitución
+    app.dependency_overrides[get_db] = no_session
+    statements = []
+    listener = lambda conn, cursor, statement, *args: statements.append(statement)
+    event.listen(engine, "before_cursor_execute", listener)
+    try:
+        r = client.get("/auth/me")
+    finally:
+        event.remove(engine, "before_cursor_execute", listener)
+    assert statements == []
+    assert r.status_code == 200
+    assert r.json()["username"] == "me-user" and r.json()["role"] == "user"
+    assert r.headers["cache-control"].startswith("private, max-age=")
+    assert "Cookie" in r.headers["vary"]
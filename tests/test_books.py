@@ -34,3 +34,555 @@ def test_books_crud(client):
     r5 = client.delete(f"/books/{book_id}")
     assert r5.status_code == 200
     assert r5.json()["message"] == "Book deleted successfully"
+
+
+def test_list_books_cursor_pagination(client):
+    for i in range(5):
+        r = client.post("/books/", data={"title": f"Cursor {i}", "author": "A", "price": 1, "section": "science"})
+        assert r.status_code == 200
+
+    seen = []
+    r = client.get("/books/", params={"section": "science", "limit": 2})
+    body = r.json()
+    seen += [b["id"] for b in body["items"]]
+    while body["next_cursor"]:
+        assert 'rel="next"' in r.headers["link"]
+        r = client.get("/books/", params={"section": "science", "limit": 2, "cursor": body["next_cursor"]})
+        assert r.status_code == 200
+        body = r.json()
+        seen += [b["id"] for b in body["items"]]
+
+    assert len(seen) == 5
+    assert seen == sorted(seen)
+    assert "link" not in r.headers
+
+    # Un cursor de otra sección o corrupto se rechaza
+    assert client.get("/books/", params={"section": "kids", "cursor": body["next_cursor"] or "x"}).status_code == 400
+
+    # limit fuera de rango: 422, no un error al calcular páginas o el cursor
+    assert client.get("/books/", params={"limit": 0}).status_code == 422
+    assert client.get("/books/", params={"limit": -1}).status_code == 422
+
+
+def test_list_books_total_uses_counters(client):
+    before = client.get("/books/", params={"section": "history"}).json()["total"]
+    r = client.post("/books/", data={"title": "Counter A", "author": "A", "price": 1, "section": "history"})
+    book_id = r.json()["id"]
+    assert client.get("/books/", params={"section": "history"}).json()["total"] == before + 1
+
+    # Cambiar de sección mueve el contador
+    client.put(f"/books/{book_id}", data={"title": "Counter A", "author": "A", "price": 1, "section": "terror"})
+    assert client.get("/books/", params={"section": "history"}).json()["total"] == before
+
+    client.delete(f"/books/{book_id}")
+    total = client.get("/books/").json()["total"]
+
+    # Recalcular requiere admin
+    assert client.post("/books/counters/rebuild").status_code == 401
+    admin = {"username": "counters-admin", "password": "Admin1234!", "role": "admin"}
+    client.post("/auth/register", json=admin)
+    client.post("/auth/login", json=admin)
+    r = client.post("/books/counters/rebuild")
+    assert r.status_code == 200
+    assert r.json()["counts"]["*"] == total
+
+
+def test_book_counts_seeded_once_from_existing_books():
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import Session
+    from app import models
+    from app.counters import adjust_book_count, get_book_count, seed_book_counts
+    from app.database import Base
+
+    # DB anterior a los contadores: libros sin ninguna fila en book_counters
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(bind=engine)
+    with Session(engine) as db:
+        sections = ["a", "a", "b", None]
+        db.add_all(models.Book(title=f"Old {i}", author="A", price=1, section=s) for i, s in enumerate(sections))
+        db.commit()
+
+    seed_book_counts(engine)
+    seed_book_counts(engine)  # segundo arranque: no vuelve a sembrar ni duplica
+    with Session(engine) as db:
+        assert (get_book_count(db, None), get_book_count(db, "a"), get_book_count(db, "b")) == (4, 2, 1)
+        # Una sección nueva se crea con el upsert de la propia escritura
+        adjust_book_count(db, "c", +1)
+        db.commit()
+        assert (get_book_count(db, None), get_book_count(db, "c"), get_book_count(db, "zzz")) == (5, 1, 0)
+
+
+def test_search_books_ranked_and_highlighted(client):
+    client.post("/books/", data={"title": "Cien años de soledad", "author": "Gabriel García Márquez", "price": 10,
+                                 "description": "Saga de la familia Buendía en Macondo"})
+    client.post("/books/", data={"title": "Crónica de una muerte anunciada", "author": "Gabriel García Márquez",
+                                 "price": 8, "description": "Novela corta; no es Macondo"})
+
+    r = client.get("/books/search", params={"q": "macondo"})
+    assert r.status_code == 200
+    body = r.json()
+    assert body["total"] == 2
+    assert all("<mark>Macondo</mark>" in item["highlight"]["description"] for item in body["items"])
+
+    # Sin acentos y como prefijo ("search as you type")
+    r = client.get("/books/search", params={"q": "anos sol"})
+    assert [item["title"] for item in r.json()["items"]] == ["Cien años de soledad"]
+
+    # Los cambios se reflejan en el índice
+    book_id = r.json()["items"][0]["id"]
+    client.put(f"/books/{book_id}", data={"title": "Cien años de soledad", "author": "GGM", "price": 10})
+    assert client.get("/books/search", params={"q": "macondo"}).json()["total"] == 1
+    client.delete(f"/books/{book_id}")
+    assert client.get("/books/search", params={"q": "soledad"}).json()["total"] == 0
+
+
+def test_search_highlight_escapes_stored_markup(client):
+    client.post("/books/", data={"title": "<img src=x onerror=alert(1)> Dune", "author": "Frank <b>Herbert</b>",
+                                 "price": 10})
+    r = client.get("/books/search", params={"q": "dune"})
+    highlight = r.json()["items"][0]["highlight"]
+    assert highlight["title"] == "&lt;img src=x onerror=alert(1)&gt; <mark>Dune</mark>"
+    assert highlight["author"] == "Frank &lt;b&gt;Herbert&lt;/b&gt;"
+
+    assert client.get("/books/search", params={"q": "dune", "limit": 0}).status_code == 422
+
+
+def test_list_books_served_from_cache_until_write(client, engine):
+    from sqlalchemy import event
+    from app.routes_books import catalog_cache
+
+    params = {"section": "ebooks", "limit": 5}
+    first = client.get("/books/", params=params).json()
+    hits = catalog_cache.hits
+    statements = []
+    listener = lambda conn, cursor, statement, *args: statements.append(statement)
+    event.listen(engine, "before_cursor_execute", listener)
+    try:
+        assert client.get("/books/", params=params).json() == first
+    finally:
+        event.remove(engine, "before_cursor_execute", listener)
+    assert catalog_cache.hits == hits + 1
+    assert statements == []  # ni la versión: sale de la copia en memoria
+
+    # Escribir en la sección invalida sus páginas...
+    client.post("/books/", data={"title": "Cached ebook", "author": "A", "price": 1, "section": "ebooks"})
+    assert client.get("/books/", params=params).json()["total"] == first["total"] + 1
+    # ...pero no las de otras secciones
+    client.get("/books/", params={"section": "kids"})
+    client.post("/books/", data={"title": "Cached ebook 2", "author": "A", "price": 1, "section": "ebooks"})
+    hits = catalog_cache.hits
+    client.get("/books/", params={"section": "kids"})
+    assert catalog_cache.hits == hits + 1
+
+
+def test_list_books_etag_not_modified(client):
+    r = client.get("/books/", params={"section": "fiction"})
+    etag = r.headers["etag"]
+    r2 = client.get("/books/", params={"section": "fiction"}, headers={"If-None-Match": etag})
+    assert r2.status_code == 304
+    assert r2.headers["etag"] == etag
+
+    # Otra página es otra representación
+    assert client.get("/books/", params={"section": "fiction", "limit": 3}).headers["etag"] != etag
+
+    client.post("/books/", data={"title": "ETag fiction", "author": "A", "price": 1, "section": "fiction"})
+    r3 = client.get("/books/", params={"section": "fiction"}, headers={"If-None-Match": etag})
+    assert r3.status_code == 200
+    assert r3.headers["etag"] != etag
+
+
+def test_list_books_etag_follows_writes_from_other_workers(client, db_session):
+    from app import models
+    from app.counters import adjust_book_count
+    from app.versions import bump_catalog_version, version_cache
+
+    params = {"section": "science"}
+    r = client.get("/books/", params=params)
+    etag, total = r.headers["etag"], r.json()["total"]
+
+    # Otro worker escribe: misma DB, pero ni su memoria ni sus cachés son las de este proceso
+    # (sin `bumped_versions` el commit no toca la copia de versiones de este proceso)
+    db_session.add(models.Book(title="Otro worker", author="A", price=1, section="science"))
+    adjust_book_count(db_session, "science", +1)
+    bump_catalog_version(db_session, "science")
+    db_session.info.pop("bumped_versions")
+    db_session.commit()
+
+    # Mientras la copia en memoria no caduca (VERSION_CACHE_TTL) sigue valiendo el ETag anterior...
+    assert client.get("/books/", params=params, headers={"If-None-Match": etag}).status_code == 304
+    # ...y al caducar se lee la versión nueva de la DB
+    version_cache.clear()
+    r = client.get("/books/", params=params, headers={"If-None-Match": etag})
+    assert r.status_code == 200
+    assert r.json()["total"] == total + 1
+
+
+def test_list_books_sparse_fields(client):
+    client.post("/books/", data={"title": "Sparse", "author": "A", "price": 3, "section": "offerts",
+                                 "description": "x" * 1000})
+    r = client.get("/books/", params={"section": "offerts", "fields": "title,price"})
+    assert r.status_code == 200
+    item = r.json()["items"][0]
+    assert set(item) == {"id", "title", "price"}
+    assert "next_cursor" in r.json()
+
+    assert client.get("/books/", params={"fields": "title,password"}).status_code == 400
+
+
+def test_image_url_resolved_at_serialization(client, db_session, upload_root):
+    from app import models
+    from app.assets import ASSET_BASE_URL
+
+    r = client.post(
+        "/books/",
+        data={"title": "Portada", "author": "A", "price": 1, "section": "club"},
+        files={"image": ("portada.jpg", b"\xff\xd8\xff\xe0fake", "image/jpeg")},
+    )
+    assert r.status_code == 200
+
+    # En DB queda la clave relativa, y listar no modifica las filas
+    book = db_session.get(models.Book, r.json()["id"])
+    assert book.image_url.startswith("books/")
+    assert r.json()["image_url"] == f"{ASSET_BASE_URL}/{book.image_url}"
+    items = client.get("/books/", params={"section": "club"}).json()["items"]
+    assert r.json()["image_url"] in [item["image_url"] for item in items]
+    assert not db_session.dirty
+
+
+def test_bulk_import_ndjson_and_csv(client):
+    ndjson = "\n".join([
+        '{"title": "Bulk 1", "author": "A", "price": 2, "section": "new"}',
+        '{"title": "Bulk 2", "author": "B"}',
+        '{"title": "Bulk 1", "author": "A"}',
+        '{"author": "sin título"}',
+        "no es json",
+    ])
+    r = client.post("/books/bulk", content=ndjson, params={"batch_size": 2},
+                    headers={"Content-Type": "application/x-ndjson"})
+    assert r.status_code == 200
+    body = r.json()
+    assert (body["created"], body["duplicate"], body["invalid"]) == (2, 1, 2)
+    assert [res["status"] for res in body["results"]] == ["created", "created", "duplicate", "invalid", "invalid"]
+
+    csv_body = 'title,author,description,year,section\n"Bulk 3",C,"línea 1\nlínea 2",1999,new\nBulk 2,B,,,\n'
+    r = client.post("/books/bulk", content=csv_body.encode(), headers={"Content-Type": "text/csv"})
+    body = r.json()
+    assert (body["created"], body["duplicate"], body["invalid"]) == (1, 1, 0)
+
+    # Contadores, caché y búsqueda quedan al día
+    titles = [b["title"] for b in client.get("/books/", params={"section": "new", "limit": 100}).json()["items"]]
+    assert {"Bulk 1", "Bulk 3"} <= set(titles)
+    assert client.get("/books/search", params={"q": "línea"}).json()["total"] == 1
+
+
+def test_bulk_import_rejects_invalid_utf8_with_line_number(client):
+    body = '{"title": "UTF-8 ok", "author": "A", "price": 1}\n'.encode() + b'{"title": "Mal \xe9", "author": "A"}\n'
+    r = client.post("/books/bulk", params={"batch_size": 1}, content=body,
+                    headers={"Content-Type": "application/x-ndjson"})
+    assert r.status_code == 400
+    assert r.json()["line"] == 2 and "UTF-8" in r.json()["detail"]
+    # La primera línea ya se había confirmado en su lote
+    assert r.json()["created"] == 1
+
+
+def test_export_books_streams_ndjson_and_csv(client):
+    import csv
+    import io
+    import json
+
+    client.post("/books/bulk", content='{"title": "Export 1", "author": "E", "section": "terror"}\n'
+                                       '{"title": "Export 2", "author": "E, Jr.", "section": "terror"}')
+    r = client.get("/books/export", params={"section": "terror"})
+    assert r.status_code == 200
+    assert r.headers["content-type"].startswith("application/x-ndjson")
+    rows = [json.loads(line) for line in r.text.splitlines()]
+    assert {"Export 1", "Export 2"} <= {row["title"] for row in rows}
+    assert all(row["section"] == "terror" for row in rows)
+
+    r = client.get("/books/export", params={"format": "csv", "section": "terror"})
+    records = list(csv.DictReader(io.StringIO(r.text)))
+    assert len(records) == len(rows)
+    assert "E, Jr." in {record["author"] for record in records}
+
+
+def test_upload_rejects_non_images_and_oversized_files(client, upload_root, monkeypatch):
+    from app import uploads
+
+    monkeypatch.setattr(uploads, "MAX_UPLOAD_BYTES", 1024)
+    data = {"title": "Subida", "author": "A", "price": 1}
+
+    r = client.post("/books/", data=data, files={"image": ("x.jpg", b"<?php echo 1; ?>", "image/jpeg")})
+    assert r.status_code == 415
+    r = client.post("/books/", data=data, files={"image": ("x.png", b"\x89PNG\r\n\x1a\n" + b"0" * 2048, "image/png")})
+    assert r.status_code == 413
+    assert [p for p in upload_root.rglob("*") if p.is_file()] == []  # sin restos del fichero temporal
+
+    r = client.post("/books/", data=data, files={"image": ("x.png", b"\x89PNG\r\n\x1a\n" + b"0" * 512, "image/png")})
+    assert r.status_code == 200
+    assert [p.stat().st_size for p in upload_root.rglob("*.png")] == [520]
+
+
+def test_oversized_multipart_rejected_before_body_is_read(client, upload_root, monkeypatch):
+    from app import uploads
+
+    monkeypatch.setattr(uploads, "MAX_UPLOAD_BYTES", 1024)
+    monkeypatch.setattr(uploads, "MULTIPART_OVERHEAD_BYTES", 1024)
+    data = {"title": "Enorme", "author": "A", "price": 1}
+    big = b"\x89PNG\r\n\x1a\n" + b"0" * 8192
+
+    # Con Content-Length: 413 sin llegar a la ruta
+    r = client.post("/books/", data=data, files={"image": ("x.png", big, "image/png")})
+    assert r.status_code == 413 and r.json()["detail"] == "Request body too large"
+
+    # Sin Content-Length (chunked): se corta al superar el límite mientras se recibe
+    body = b"--b\r\nContent-Disposition: form-data; name=\"title\"\r\n\r\nEnorme\r\n--b--\r\n" + big
+    def chunks():
+        for start in range(0, len(body), 512):
+            yield body[start:start + 512]
+    r = client.post("/books/", content=chunks(), headers={"Content-Type": "multipart/form-data; boundary=b"})
+    assert r.status_code == 413
+    assert client.get("/books/search", params={"q": "enorme"}).json()["total"] == 0
+
+
+def test_identical_covers_are_stored_once_and_reference_counted(client, db_session, upload_root):
+    import hashlib
+    from app import models
+
+    cover = b"\xff\xd8\xff\xe0" + b"same cover" * 100
+    sha = hashlib.sha256(cover).hexdigest()
+    ids = [
+        client.post("/books/", data={"title": f"Dedup {i}", "author": "A", "price": 1},
+                    files={"image": (f"cover{i}.jpg", cover, "image/jpeg")}).json()["id"]
+        for i in range(2)
+    ]
+    key = f"books/{sha[:2]}/{sha[2:4]}/{sha}.jpg"
+    assert (upload_root / key).exists()
+    assert len([p for p in upload_root.rglob("*.jpg")]) == 1
+    assert db_session.get(models.Asset, key).refcount == 2
+
+    # El fichero sobrevive mientras algún libro lo use
+    client.delete(f"/books/{ids[0]}")
+    assert (upload_root / key).exists()
+    client.delete(f"/books/{ids[1]}")
+    assert not (upload_root / key).exists()
+
+
+def test_delete_unused_asset_only_removes_unreferenced_rows(db_session, upload_root):
+    from app import models
+    from app.assets import delete_unused_asset
+
+    keys = {}
+    for name, refcount in (("aa", 1), ("bb", 0), ("cc", None)):
+        sha = name * 32
+        keys[name] = key = f"books/{sha[:2]}/{sha[2:4]}/{sha}.jpg"
+        (upload_root / key).parent.mkdir(parents=True, exist_ok=True)
+        (upload_root / key).write_bytes(b"cover")
+        if refcount is not None:
+            db_session.add(models.Asset(key=key, sha256=sha, size=5, refcount=refcount))
+    db_session.commit()
+
+    for key in keys.values():
+        delete_unused_asset(db_session, key)
+    # Referenciado (una subida lo reutilizó) o sin fila: el fichero se queda
+    assert (upload_root / keys["aa"]).exists() and db_session.get(models.Asset, keys["aa"]) is not None
+    assert (upload_root / keys["cc"]).exists()
+    assert not (upload_root / keys["bb"]).exists() and db_session.get(models.Asset, keys["bb"]) is None
+
+
+def test_content_addressed_files_are_served_immutable(upload_root):
+    from fastapi import FastAPI
+    from fastapi.testclient import TestClient
+    from app.static import AssetStaticFiles
+
+    sha = "ab" * 32
+    (upload_root / "books/ab/ab").mkdir(parents=True)
+    (upload_root / f"books/ab/ab/{sha}.jpg").write_bytes(b"img")
+    (upload_root / ".tmp").mkdir()
+    (upload_root / ".tmp/x.part").write_bytes(b"partial")
+
+    (upload_root / "legacy.jpg").write_bytes(b"0123456789")
+
+    app = FastAPI()
+    app.mount("/uploads", AssetStaticFiles(directory=str(upload_root), sendfile="", cache_rules="legacy=no-cache"))
+    app.mount("/accel", AssetStaticFiles(directory=str(upload_root), sendfile="x-accel", accel_prefix="/internal"))
+    with TestClient(app) as c:
+        r = c.get(f"/uploads/books/ab/ab/{sha}.jpg")
+        assert r.status_code == 200
+        assert "immutable" in r.headers["cache-control"]
+        assert r.headers["etag"] == f'"{sha}"'
+        assert c.get(f"/uploads/books/ab/ab/{sha}.jpg", headers={"If-None-Match": f'"{sha}"'}).status_code == 304
+        assert c.get("/uploads/.tmp/x.part").status_code == 404
+
+        # Reglas por prefijo y rangos de bytes
+        r = c.get("/uploads/legacy.jpg", headers={"Range": "bytes=2-4"})
+        assert r.status_code == 206
+        assert r.content == b"234"
+        assert r.headers["cache-control"] == "no-cache"
+
+        # Entrega delegada en nginx: sin cuerpo, con la ruta interna
+        r = c.get(f"/accel/books/ab/ab/{sha}.jpg")
+        assert r.headers["x-accel-redirect"] == f"/internal/books/ab/ab/{sha}.jpg"
+        assert r.content == b""
+
+
+def test_cover_derivatives_generated_in_background(client, db_session, upload_root):
+    import io
+    import time
+    import pytest
+    from app import models
+
+    Image = pytest.importorskip("PIL.Image")
+    buffer = io.BytesIO()
+    Image.new("RGB", (800, 1200), (200, 30, 30)).save(buffer, "JPEG")
+
+    r = client.post("/books/", data={"title": "Derivados", "author": "A", "price": 1, "section": "kids"},
+                    files={"image": ("cover.jpg", buffer.getvalue(), "image/jpeg")})
+    book_id = r.json()["id"]
+
+    # La petición no espera al redimensionado: se genera en el pool de procesos
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        db_session.expire_all()
+        if db_session.get(models.Book, book_id).image_variants:
+            break
+        time.sleep(0.1)
+    book = db_session.get(models.Book, book_id)
+    assert book.image_variants == "160,320,640"
+    stem = book.image_url.rsplit(".", 1)[0]
+    assert (upload_root / f"{stem}-320w.webp").exists()
+    assert (upload_root / f"{stem}-640w.jpg").exists()
+
+    item = next(b for b in client.get("/books/", params={"section": "kids"}).json()["items"] if b["id"] == book_id)
+    assert item["image_srcset"]["image/webp"].endswith(f"{stem}-640w.webp 640w")
+    sparse = client.get("/books/", params={"section": "kids", "fields": "image_url"}).json()["items"]
+    assert any(b.get("image_srcset") for b in sparse)
+
+
+def test_cover_derivatives_follow_exif_orientation(tmp_path):
+    import pytest
+    from app.images import derivative_key, generate_derivatives
+
+    Image = pytest.importorskip("PIL.Image")
+    # Portada vertical guardada en horizontal (1200x800) con Orientation=6 (girar 90º)
+    exif = Image.Exif()
+    exif[0x0112] = 6
+    key = "books/rotated.jpg"
+    (tmp_path / "books").mkdir()
+    Image.new("RGB", (1200, 800), (10, 10, 200)).save(tmp_path / key, "JPEG", exif=exif)
+
+    assert generate_derivatives(str(tmp_path), key, (160, 640, 1000)) == [160, 640]
+    with Image.open(tmp_path / derivative_key(key, 160, "jpg")) as derived:
+        assert derived.size == (160, 240)
+        assert derived.getexif().get(0x0112) is None
+    with Image.open(tmp_path / derivative_key(key, 640, "webp")) as derived:
+        assert derived.size == (640, 960)
+
+
+def test_asset_gc_removes_unreferenced_uploads(db_session, upload_root):
+    import os
+    import time
+    from app import models
+    from app.asset_gc import collect_orphans
+
+    def write(key, age=7200):
+        path = upload_root / key
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(b"img")
+        os.utime(path, (time.time() - age, time.time() - age))
+
+    used, orphan = "cd" * 32, "ef" * 32
+    write(f"books/cd/cd/{used}.jpg")
+    write(f"books/cd/cd/{used}-320w.webp")
+    write(f"books/ef/ef/{orphan}.jpg")
+    write(f"books/ef/ef/{orphan}-320w.webp")
+    write("books/legacy-used.jpg")
+    write("books/legacy-orphan.jpg")
+    write("books/just-uploaded.jpg", age=0)
+    db_session.add_all([
+        models.Book(title="GC usado", author="A", image_url=f"books/cd/cd/{used}.jpg"),
+        models.Book(title="GC antiguo", author="A", image_url="http://localhost:8000/uploads/books/legacy-used.jpg"),
+        models.Asset(key=f"books/ef/ef/{orphan}.jpg", sha256=orphan, size=3, refcount=0),
+    ])
+    db_session.commit()
+
+    expected = sorted([f"books/ef/ef/{orphan}.jpg", f"books/ef/ef/{orphan}-320w.webp", "books/legacy-orphan.jpg"])
+    report = collect_orphans(db_session, dry_run=True, batch_size=2)
+    assert sorted(report["keys"]) == expected
+    assert all((upload_root / key).exists() for key in expected)
+
+    report = collect_orphans(db_session, batch_size=2)
+    assert sorted(report["keys"]) == expected
+    assert not any((upload_root / key).exists() for key in expected)
+    assert (upload_root / f"books/cd/cd/{used}-320w.webp").exists()
+    assert (upload_root / "books/legacy-used.jpg").exists()
+    assert (upload_root / "books/just-uploaded.jpg").exists()
+    assert db_session.get(models.Asset, f"books/ef/ef/{orphan}.jpg") is None
+
+
+def test_asset_gc_spares_keys_reacquired_after_listing(db_session, upload_root, monkeypatch):
+    import os
+    import time
+    from app import asset_gc, models
+
+    old = time.time() - 7200
+    reacquired, retouched = "ab" * 32, "ba" * 32
+    for sha in (reacquired, retouched):
+        path = upload_root / f"books/{sha[:2]}/{sha[2:4]}/{sha}.jpg"
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(b"img")
+        os.utime(path, (old, old))
+    # Una subida idéntica sumó la referencia; su libro aún no ha hecho commit
+    db_session.add(models.Asset(key=f"books/ab/ab/{reacquired}.jpg", sha256=reacquired, size=3, refcount=1))
+    db_session.commit()
+    # Y otra renovó el mtime después de que el GC listara el fichero
+    listing = list(asset_gc.iter_file_groups("books/"))
+    os.utime(upload_root / f"books/ba/ba/{retouched}.jpg")
+    monkeypatch.setattr(asset_gc, "iter_file_groups", lambda prefix: iter(listing))
+
+    report = asset_gc.collect_orphans(db_session)
+    assert report["orphans"] == 0
+    assert (upload_root / f"books/ab/ab/{reacquired}.jpg").exists()
+    assert (upload_root / f"books/ba/ba/{retouched}.jpg").exists()
+    assert db_session.get(models.Asset, f"books/ab/ab/{reacquired}.jpg").refcount == 1
+
+
+def test_cover_metadata_computed_at_upload(client, upload_root):
+    import io
+    import pytest
+
+    Image = pytest.importorskip("PIL.Image")
+    buffer = io.BytesIO()
+    Image.new("RGB", (300, 450), (20, 60, 200)).save(buffer, "PNG")
+
+    r = client.post("/books/", data={"title": "Metadatos", "author": "A", "price": 1, "section": "science"},
+                    files={"image": ("cover.png", buffer.getvalue(), "image/png")})
+    book = r.json()
+    assert (book["image_width"], book["image_height"]) == (300, 450)
+    assert book["image_color"] == "#143cc8"
+    assert book["image_blurhash"].startswith("T") and len(book["image_blurhash"]) == 28
+
+    items = client.get("/books/", params={"section": "science", "fields": "title,image_url"}).json()["items"]
+    item = next(b for b in items if b["id"] == book["id"])
+    assert item["image_blurhash"] == book["image_blurhash"]
+    assert "price" not in item
+
+    # La búsqueda también trae los metadatos del placeholder
+    hit = client.get("/books/search", params={"q": "metadatos"}).json()["items"][0]
+    assert (hit["image_width"], hit["image_color"], hit["image_blurhash"]) == (300, "#143cc8", book["image_blurhash"])
+
+
+def test_blurhash_matches_reference_encoder():
+    import pytest
+    from app.images import blurhash
+
+    Image = pytest.importorskip("PIL.Image")
+    # Valores esperados calculados con el codificador de referencia (blurhash-python 1.1.4)
+    gradient = Image.new("RGB", (32, 24))
+    gradient.putdata([(x * 8, y * 10, 255 - x * 4) for y in range(24) for x in range(32)])
+    assert blurhash(gradient, 4, 3) == "LxH28X2zw$XAmIWYjuf8gJfjfQfj"
+
+    checker = Image.new("RGB", (20, 30))
+    checker.putdata([
+        ((x * 13 + y * 7) % 256, 200 if (x // 5 + y // 5) % 2 else 40, y * 8) for y in range(30) for x in range(20)
+    ])
+    assert blurhash(checker, 3, 5) == "cpHV3WxaN]oUEzJljxN^$5obaNsUjsWpjt"
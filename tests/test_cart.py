@@ -0,0 +1,60 @@
+# tests/test_cart.py
+def _user_and_book(client, name):
+    user_id = client.post("/auth/register", json={"username": name, "password": "Cart1234!"}).json()["id"]
+    book_id = client.post("/books/", data={"title": f"Libro de {name}", "author": "A", "price": 5}).json()["id"]
+    return user_id, book_id
+
+
+def test_cart_etag_changes_with_cart(client, engine):
+    from sqlalchemy import event
+
+    user_id, book_id = _user_and_book(client, "cart-etag")
+
+    etag = client.get(f"/cart/{user_id}").headers["etag"]
+    # El 304 sale de las versiones en memoria: ninguna consulta
+    statements = []
+    listener = lambda conn, cursor, statement, *args: statements.append(statement)
+    event.listen(engine, "before_cursor_execute", listener)
+    try:
+        assert client.get(f"/cart/{user_id}", headers={"If-None-Match": etag}).status_code == 304
+    finally:
+        event.remove(engine, "before_cursor_execute", listener)
+    assert statements == []
+
+    r = client.post("/cart/", json={"user_id": user_id, "book_id": book_id})
+    assert r.status_code == 200
+    r = client.get(f"/cart/{user_id}", headers={"If-None-Match": etag})
+    assert r.status_code == 200
+    assert [item["book"]["id"] for item in r.json()] == [book_id]
+
+
+def test_get_cart_query_count_does_not_grow_with_items(client, engine, monkeypatch):
+    from sqlalchemy import event
+    from app import versions
+
+    monkeypatch.setattr(versions, "VERSION_CACHE_TTL", 0)  # las dos lecturas leen las versiones de la DB
+
+    user_id, first_book = _user_and_book(client, "cart-n1")
+    books = [first_book] + [
+        client.post("/books/", data={"title": f"Extra {i}", "author": "A", "price": 1}).json()["id"] for i in range(5)
+    ]
+
+    def statements_for_cart():
+        statements = []
+        listener = lambda conn, cursor, statement, *args: statements.append(statement)
+        event.listen(engine, "before_cursor_execute", listener)
+        try:
+            r = client.get(f"/cart/{user_id}")
+        finally:
+            event.remove(engine, "before_cursor_execute", listener)
+        assert r.status_code == 200
+        return len(statements), r.json()
+
+    client.post("/cart/", json={"user_id": user_id, "book_id": books[0]})
+    one, _ = statements_for_cart()
+    for book_id in books[1:]:
+        client.post("/cart/", json={"user_id": user_id, "book_id": book_id})
+    many, items = statements_for_cart()
+
+    assert sorted(item["book"]["id"] for item in items) == sorted(books)
+    assert many == one
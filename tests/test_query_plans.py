@@ -0,0 +1,63 @@
+# tests/test_query_plans.py
+from contextlib import contextmanager
+from sqlalchemy import event
+import re
+
+
+@contextmanager
+def captured_statements(engine):
+    """Captura (sql, params) de todo lo que ejecutan las rutas sobre el engine de tests."""
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if not executemany:
+            statements.append((statement, parameters))
+
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, "before_cursor_execute", before_cursor_execute)
+
+
+def query_plan(engine, statement, parameters):
+    with engine.connect() as conn:
+        rows = conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters).fetchall()
+    return [row[-1] for row in rows]
+
+
+def test_hot_queries_use_indexes(client, engine):
+    user = {"username": "plans-user", "password": "Plans1234!"}
+    with captured_statements(engine) as statements:
+        user_id = client.post("/auth/register", json=user).json()["id"]
+        client.post("/auth/login", json=user)
+
+        ids = [
+            client.post("/books/", data={"title": f"Plan {i}", "author": "A", "price": 1, "section": "club"}).json()["id"]
+            for i in range(3)
+        ]
+        first = client.get("/books/", params={"section": "club", "limit": 2}).json()
+        client.get("/books/", params={"section": "club", "limit": 2, "cursor": first["next_cursor"]})
+        client.get("/books/", params={"section": "club", "page": 2, "limit": 2})
+        client.put(f"/books/{ids[0]}", data={"title": "Plan 0", "author": "B", "price": 2, "section": "new"})
+
+        client.post("/cart/", json={"user_id": user_id, "book_id": ids[0]})
+        client.post("/cart/", json={"user_id": user_id, "book_id": ids[1]})
+        client.get(f"/cart/{user_id}")
+        client.delete(f"/cart/{user_id}/remove/{ids[0]}")
+        client.delete(f"/cart/{user_id}/clear")
+        client.delete(f"/books/{ids[2]}")
+
+    checked = 0
+    for statement, parameters in statements:
+        if not statement.lstrip().upper().startswith(("SELECT", "UPDATE", "DELETE")):
+            continue
+        plan = query_plan(engine, statement, parameters)
+        checked += 1
+        # Toda consulta filtrada debe resolverse con un índice (SEARCH), nunca recorriendo la tabla
+        if re.search(r"\bWHERE\b", statement):
+            assert not any(step.startswith("SCAN") for step in plan), (statement, plan)
+        # Y ningún orden de paginación debe necesitar un sort temporal
+        assert not any("TEMP B-TREE" in step for step in plan), (statement, plan)
+
+    assert checked > 10
@@ -0,0 +1,87 @@
+import pytest
+
+moto = pytest.importorskip("moto")
+boto3 = pytest.importorskip("boto3")
+
+
+@pytest.fixture()
+def s3_storage(monkeypatch):
+    """Almacenamiento S3 simulado en memoria con moto."""
+    from app import covers, storage
+
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    with moto.mock_aws():
+        boto3.client("s3", region_name="us-east-1").create_bucket(Bucket="covers")
+        s3 = storage.S3Storage("covers", prefix="assets/", region="us-east-1", part_size=5 * 1024 * 1024)
+        monkeypatch.setattr(storage, "_storage", s3)
+        # Los procesos de derivados no ven el mock: aquí se prueban en el propio proceso
+        monkeypatch.setattr(covers, "Image", None)
+        yield s3
+
+
+def test_s3_storage_create_serve_and_delete(client, s3_storage):
+    from fastapi import FastAPI
+    from fastapi.testclient import TestClient
+    from app.static import AssetStaticFiles
+
+    cover = b"\xff\xd8\xff\xe0" + b"s3 cover" * 100
+    r = client.post("/books/", data={"title": "En S3", "author": "A", "price": 1},
+                    files={"image": ("cover.jpg", cover, "image/jpeg")})
+    assert r.status_code == 200
+    book_id = r.json()["id"]
+    key = r.json()["image_url"].split("/uploads/", 1)[1]
+
+    head = s3_storage.client.head_object(Bucket="covers", Key=f"assets/{key}")
+    assert head["ContentType"] == "image/jpeg"
+    assert "immutable" in head["CacheControl"]
+
+    app = FastAPI()
+    app.mount("/uploads", AssetStaticFiles(storage=s3_storage))
+    with TestClient(app) as c:
+        r = c.get(f"/uploads/{key}")
+        assert r.status_code == 200
+        assert r.content == cover
+        assert "immutable" in r.headers["cache-control"]
+        assert c.get(f"/uploads/{key}", headers={"If-None-Match": r.headers["etag"]}).status_code == 304
+        assert c.get("/uploads/books/missing.jpg").status_code == 404
+
+    client.delete(f"/books/{book_id}")
+    assert s3_storage.stat(key) is None
+
+
+def test_s3_storage_multipart_upload_and_derivatives(s3_storage, tmp_path):
+    from app.covers import generate_stored_derivatives
+
+    big = tmp_path / "big.part"
+    big.write_bytes(b"x" * (6 * 1024 * 1024))
+    assert s3_storage.publish(str(big), "books/big.bin") is False
+    assert s3_storage.stat("books/big.bin").size == 6 * 1024 * 1024
+    assert not big.exists()
+
+    Image = pytest.importorskip("PIL.Image")
+    original = tmp_path / "cover.part"
+    Image.new("RGB", (400, 600), (10, 120, 10)).save(original, "JPEG")
+    key = f"books/aa/bb/{'aabb' * 16}.jpg"
+    s3_storage.publish(str(original), key, "image/jpeg")
+
+    assert generate_stored_derivatives(s3_storage, key, (160, 320, 640)) == [160, 320]
+    keys = [stored.key for stored in s3_storage.list(f"books/aa/bb/{'aabb' * 16}-")]
+    assert keys == [f"books/aa/bb/{'aabb' * 16}-{w}w.{ext}" for w in (160, 320) for ext in ("jpg", "webp")]
+
+
+def test_incomplete_storage_backend_fails_at_construction():
+    from app.storage import Storage
+
+    class NoDelete(Storage):
+        def temp_dir(self): ...
+        def publish(self, tmp_path, key, content_type=None, cache_control=None): ...
+        def download(self, key, path): ...
+        def stat(self, key): ...
+        def open(self, key): ...
+        def list(self, prefix): ...
+
+    with pytest.raises(TypeError):
+        NoDelete()
+    with pytest.raises(TypeError):
+        Storage()